@@ -0,0 +1,104 @@
+"""
+Compara os leitores de planilha (planilha.LEITORES) sobre Clinicas/.
+
+Cada leitor roda em um subprocesso próprio, para o pico de memória (RSS) de
+um não contaminar o outro. A saída de cada um é conferida contra o
+golden_parse.json; só vale escolher um leitor com todas as planilhas certas.
+
+    python benchmark_leitores.py
+    python benchmark_leitores.py --repeticoes 5 --leitores openpyxl calamine
+
+O leitor escolhido vai em PLANILHA_LEITOR.
+"""
+
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import planilha
+import verificar_parse
+
+
+def medir(leitor, pasta, repeticoes):
+    """Roda no subprocesso: melhor tempo de N passadas, pico de RSS e acertos."""
+    caminhos = sorted(glob.glob(os.path.join(pasta, "*.xlsx")))
+    with open(verificar_parse.GOLDEN) as f:
+        golden = json.load(f)
+
+    rss_inicial = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tempos, corretos = [], 0
+
+    for r in range(repeticoes):
+        inicio = time.perf_counter()
+        saidas = [planilha.parse_excel_from_bytes(c, leitor=leitor) for c in caminhos]
+        tempos.append(time.perf_counter() - inicio)
+
+        if r == 0:
+            corretos = sum(
+                verificar_parse.resumo(p) == golden.get(os.path.basename(c))
+                for c, p in zip(caminhos, saidas)
+            )
+
+    # ru_maxrss em KB no Linux
+    return {
+        "arquivos": len(caminhos),
+        "corretos": corretos,
+        "tempo": min(tempos),
+        "pico_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_extra_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_inicial) / 1024,
+    }
+
+
+def rodar(leitor, pasta, repeticoes):
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--filho", leitor,
+         "--pasta", pasta, "--repeticoes", str(repeticoes)],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        erro = (proc.stderr.strip().splitlines() or ["erro desconhecido"])[-1]
+        return {"erro": erro}
+    return json.loads(proc.stdout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dos leitores de planilha.")
+    parser.add_argument("--pasta", default=verificar_parse.PASTA)
+    parser.add_argument("--leitores", nargs="+", default=list(planilha.LEITORES), choices=list(planilha.LEITORES))
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--filho", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.filho:
+        print(json.dumps(medir(args.filho, args.pasta, args.repeticoes)))
+        sys.exit(0)
+
+    print(f"{'leitor':<10} {'tempo':>8} {'arq/s':>7} {'pico RSS':>10} {'RSS extra':>10}  corretos")
+
+    validos = {}
+    for leitor in args.leitores:
+        r = rodar(leitor, args.pasta, args.repeticoes)
+        if "erro" in r:
+            print(f"{leitor:<10} ⚠️  {r['erro']}")
+            continue
+
+        ok = r["corretos"] == r["arquivos"]
+        print(
+            f"{leitor:<10} {r['tempo']:7.2f}s {r['arquivos'] / r['tempo']:7.1f} "
+            f"{r['pico_rss_mb']:8.0f}MB {r['rss_extra_mb']:8.0f}MB  "
+            f"{r['corretos']}/{r['arquivos']} {'✅' if ok else '❌'}"
+        )
+        if ok:
+            validos[leitor] = r["tempo"]
+
+    if validos:
+        melhor = min(validos, key=validos.get)
+        print(f"\n🏁 Mais rápido com saída correta: {melhor} (PLANILHA_LEITOR={melhor})")
+    else:
+        sys.exit("\n❌ Nenhum leitor reproduziu o golden.")
@@ -0,0 +1,227 @@
+import asyncio
+import os
+import threading
+import time
+
+import pandas as pd
+
+from credito import COLUNAS_NUMERICAS
+from supabase_client import get_async_client
+
+# ==========================
+# CONFIG
+# ==========================
+
+# Depois deste tempo o snapshot ainda é servido, mas uma nova carga é
+# disparada em background (stale-while-revalidate).
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "300"))
+
+# Depois de uma carga que falhou, quanto esperar antes de tentar de novo
+# (padrão: 1/10 do TTL), para um PostgREST fora do ar não receber uma carga
+# completa a cada requisição.
+DASHBOARD_CACHE_ESPERA_ERRO = float(
+    os.getenv("DASHBOARD_CACHE_ESPERA_ERRO", str(DASHBOARD_CACHE_TTL / 10))
+)
+
+VIEW_DASHBOARD = "vw_dashboard_final"
+
+# Colunas da view que os endpoints usam; as demais (30+) não trafegam
+COLUNAS_VIEW = [
+    "clinica_id",
+    "clinica_nome",
+    "cnpj",
+    "external_id",
+    "mes_ref",
+    "mes_ref_date",
+    *COLUNAS_NUMERICAS,
+    "qtde_boletos",
+]
+
+
+def tipar(rows):
+    """Linhas da view como DataFrame com mes_ref_date em datetime e métricas numéricas."""
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+
+    if "mes_ref_date" in df.columns:
+        df["mes_ref_date"] = pd.to_datetime(df["mes_ref_date"], errors="coerce")
+    elif "mes_ref" in df.columns:
+        df["mes_ref_date"] = pd.to_datetime(df["mes_ref"], errors="coerce")
+
+    for col in COLUNAS_NUMERICAS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    return df
+
+
+# ==========================
+# CONSULTA (PostgREST)
+# ==========================
+
+def consulta_view(colunas=None, clinica_id=None, inicio=None, fim=None):
+    """
+    Parâmetros PostgREST para a vw_dashboard_final, com a projeção e os
+    filtros resolvidos no banco em vez de em memória:
+      - colunas: lista do select (padrão COLUNAS_VIEW)
+      - clinica_id: um id (eq.) ou uma lista de ids (in.)
+      - inicio / fim: datas → mes_ref_date=gte.inicio / lt.fim
+
+    Devolve uma lista de pares, porque o mesmo campo pode aparecer duas vezes
+    (requests e httpx aceitam os dois formatos).
+    """
+    params = [("select", ",".join(colunas or COLUNAS_VIEW))]
+
+    if isinstance(clinica_id, str):
+        params.append(("clinica_id", f"eq.{clinica_id}"))
+    elif clinica_id is not None:
+        params.append(("clinica_id", f"in.({','.join(clinica_id)})"))
+
+    if inicio:
+        params.append(("mes_ref_date", f"gte.{inicio}"))
+    if fim:
+        params.append(("mes_ref_date", f"lt.{fim}"))
+
+    return params
+
+
+async def carregar_view(colunas=None, **filtros):
+    """Linhas da view (lista de dicts) direto do PostgREST, com consulta_view."""
+    r = await get_async_client().get(VIEW_DASHBOARD, params=consulta_view(colunas, **filtros))
+    if r.status_code not in (200, 206):
+        raise RuntimeError(f"Erro ao buscar {VIEW_DASHBOARD}: {r.status_code} - {r.text}")
+    return r.json()
+
+
+# ==========================
+# SNAPSHOT EM MEMÓRIA
+# ==========================
+
+class SnapshotDashboard:
+    """
+    Cópia da vw_dashboard_final em memória, compartilhada pelos endpoints.
+
+    Só a primeira leitura espera a carga; depois disso `obter` sempre devolve
+    o snapshot atual na hora e, se ele passou do TTL ou foi invalidado por
+    uma escrita, dispara uma única recarga em background. Uma carga que
+    falhou só é tentada de novo depois de `espera_erro` segundos. O DataFrame é
+    compartilhado entre requisições: quem for alterá-lo faz `.copy()`.
+
+    O cache é por processo; com vários workers do gunicorn cada um tem o seu
+    e a invalidação só vale para o processo que fez a escrita (o TTL cobre
+    os demais).
+    """
+
+    def __init__(self, carregar=carregar_view, ttl=DASHBOARD_CACHE_TTL, espera_erro=DASHBOARD_CACHE_ESPERA_ERRO):
+        self.carregar = carregar
+        self.ttl = ttl
+        self.espera_erro = espera_erro
+        self.colunas = COLUNAS_VIEW  # vira ["*"] se a view recusar a projeção
+
+        self._df = None
+        self._derivados = (None, {})  # (snapshot, chave -> resultado)
+        self._carregado_em = 0.0
+        self._geracao = 0          # incrementa a cada invalidação
+        self._geracao_df = -1      # geração vigente quando o snapshot foi carregado
+        self._erro = None
+        self._falhou_em = 0.0      # momento da última carga que falhou
+        self._tarefa = None
+        self._lock = threading.Lock()  # invalidar() vem das threads de upload
+
+    def _vencido(self):
+        with self._lock:
+            invalidado = self._geracao_df != self._geracao
+        return invalidado or time.monotonic() - self._carregado_em > self.ttl
+
+    def _esperando(self):
+        """A última carga falhou há menos de `espera_erro`: não tenta de novo ainda."""
+        return self._erro is not None and time.monotonic() - self._falhou_em < self.espera_erro
+
+    async def _atualizar(self):
+        with self._lock:
+            geracao = self._geracao
+
+        try:
+            df = tipar(await self._ler())
+        except Exception as e:
+            self._erro = e
+            self._falhou_em = time.monotonic()
+            return
+
+        self._df = df
+        self._derivados = (df, {})
+        self._erro = None
+        self._carregado_em = time.monotonic()
+        # invalidado durante a carga? fica vencido e a próxima leitura recarrega
+        with self._lock:
+            self._geracao_df = geracao
+
+    async def _ler(self):
+        try:
+            return await self.carregar(self.colunas)
+        except RuntimeError as e:
+            # 42703 = coluna inexistente: a view não tem alguma das COLUNAS_VIEW
+            if self.colunas == ["*"] or "42703" not in str(e):
+                raise
+            self.colunas = ["*"]
+            return await self.carregar(self.colunas)
+
+    def _disparar(self):
+        if self._tarefa is None or self._tarefa.done():
+            self._tarefa = asyncio.get_running_loop().create_task(self._atualizar())
+        return self._tarefa
+
+    async def obter(self) -> pd.DataFrame:
+        if self._df is None:
+            if not self._esperando():
+                await self._disparar()
+            if self._df is None:
+                raise RuntimeError(f"Snapshot do dashboard indisponível: {self._erro}")
+        elif self._vencido() and not self._esperando():
+            self._disparar()
+
+        return self._df
+
+    async def derivado(self, chave, calcular):
+        """
+        calcular(snapshot) guardado por `chave` até o snapshot ser trocado,
+        para os endpoints não recalcularem o mesmo resultado a cada requisição.
+        """
+        df = await self.obter()
+        dono, memo = self._derivados
+        if dono is not df:
+            return calcular(df)
+        if chave not in memo:
+            memo[chave] = calcular(df)
+        return memo[chave]
+
+    def invalidar(self):
+        """Marca o snapshot como desatualizado (chamado após escritas nas tabelas da view)."""
+        with self._lock:
+            self._geracao += 1
+
+    def info(self):
+        return {
+            "linhas": None if self._df is None else len(self._df),
+            "idade_s": round(time.monotonic() - self._carregado_em, 1) if self._df is not None else None,
+            "vencido": self._df is not None and self._vencido(),
+            "projecao": self.colunas != ["*"],
+            "erro": str(self._erro) if self._erro else None,
+        }
+
+
+_snapshot = None
+
+
+def get_snapshot() -> SnapshotDashboard:
+    global _snapshot
+
+    if _snapshot is None:
+        _snapshot = SnapshotDashboard()
+
+    return _snapshot
+
+
+def invalidar_dashboard():
+    get_snapshot().invalidar()
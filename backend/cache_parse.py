@@ -0,0 +1,143 @@
+import os
+import pickle
+import stat
+import tempfile
+import threading
+
+# ==========================
+# CONFIG
+# ==========================
+
+# Pasta privada do usuário (não o /tmp compartilhado): o cache é lido com pickle
+PARSE_CACHE_DIR = os.getenv(
+    "PARSE_CACHE_DIR",
+    os.path.join(
+        os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "clinicas_parse_cache",
+    ),
+)
+PARSE_CACHE_MAX_MB = float(os.getenv("PARSE_CACHE_MAX_MB", "256"))
+
+# Mudou o formato do parse? Troque a versão e o cache antigo é ignorado.
+PARSE_CACHE_VERSAO = "2"
+
+
+# ==========================
+# CACHE EM DISCO
+# ==========================
+
+def _pasta_privada(pasta):
+    """
+    Cria a pasta com modo 0700 e confere que ela é um diretório de verdade
+    (não symlink), do usuário do processo e sem acesso para grupo/outros.
+    Como o conteúdo é carregado com pickle, qualquer outra situação deixaria
+    outro usuário executar código no processo.
+    """
+    try:
+        os.makedirs(pasta, mode=0o700, exist_ok=True)
+        st = os.lstat(pasta)
+    except OSError:
+        return False
+
+    return (
+        stat.S_ISDIR(st.st_mode)
+        and st.st_uid == os.getuid()
+        and not st.st_mode & 0o077
+    )
+
+
+class CacheParse:
+    """
+    Resultado de parse_excel_from_bytes em disco, indexado pelo SHA-256 do
+    arquivo. Ao passar de `max_bytes`, os arquivos lidos há mais tempo
+    (mtime, atualizado a cada leitura) são removidos.
+
+    Se a pasta não for privada (ver _pasta_privada) o cache fica desligado.
+    """
+
+    def __init__(self, pasta=PARSE_CACHE_DIR, max_bytes=int(PARSE_CACHE_MAX_MB * 1024 * 1024)):
+        self.pasta = pasta
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self.ativo = max_bytes > 0 and _pasta_privada(pasta)
+        if max_bytes > 0 and not self.ativo:
+            print(f"⚠️ Cache de parse desligado: {pasta} não é uma pasta privada (0700) deste usuário")
+
+    def _caminho(self, sha256):
+        return os.path.join(self.pasta, f"{sha256}.v{PARSE_CACHE_VERSAO}.pkl")
+
+    def obter(self, sha256):
+        if not self.ativo:
+            return None
+
+        caminho = self._caminho(sha256)
+        try:
+            with open(caminho, "rb") as f:
+                parsed = pickle.load(f)
+            os.utime(caminho)
+            return parsed
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # arquivo truncado/corrompido: descarta e reprocessa
+            self._remover(caminho)
+            return None
+
+    def salvar(self, sha256, parsed):
+        if not self.ativo:
+            return
+
+        caminho = self._caminho(sha256)
+
+        fd, tmp = tempfile.mkstemp(dir=self.pasta, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, caminho)
+        except Exception:
+            self._remover(tmp)
+            raise
+
+        self._despejar()
+
+    def _despejar(self):
+        with self._lock:
+            try:
+                entradas = [e for e in os.scandir(self.pasta) if e.name.endswith(".pkl")]
+            except FileNotFoundError:
+                return
+
+            stats = []
+            for e in entradas:
+                try:
+                    stats.append((e.path, e.stat()))
+                except FileNotFoundError:
+                    pass  # removido por outro processo
+
+            total = sum(st.st_size for _, st in stats)
+
+            for caminho, st in sorted(stats, key=lambda x: x[1].st_mtime):
+                if total <= self.max_bytes:
+                    break
+                self._remover(caminho)
+                total -= st.st_size
+
+    @staticmethod
+    def _remover(caminho):
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+_cache = None
+
+
+def get_cache() -> CacheParse:
+    global _cache
+
+    if _cache is None:
+        _cache = CacheParse()
+
+    return _cache
@@ -0,0 +1,143 @@
+import os
+import threading
+from collections import OrderedDict
+
+from supabase_client import get_client
+
+# ==========================
+# CONFIG
+# ==========================
+
+# Quantos CNPJs manter em memória (os menos usados saem primeiro)
+CLINICAS_CACHE_TAMANHO = int(os.getenv("CLINICAS_CACHE_TAMANHO", "4096"))
+
+
+def _in_list(valores):
+    """Filtro `in.(...)` do PostgREST, com aspas para CNPJs com . / -"""
+    return "in.(" + ",".join(f'"{v}"' for v in valores) + ")"
+
+
+# ==========================
+# RESOLVEDOR
+# ==========================
+
+class ResolvedorClinicas:
+    """
+    CNPJ → clinica_id com cache LRU em memória. CNPJs fora do cache são
+    buscados juntos em um único GET `cnpj=in.(...)`, e as clínicas que
+    ainda não existem são criadas em um único upsert que já devolve os ids.
+    """
+
+    def __init__(self, client, tamanho=CLINICAS_CACHE_TAMANHO):
+        self.client = client
+        self.tamanho = tamanho
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _guardar(self, ids):
+        with self._lock:
+            for cnpj, clinica_id in ids.items():
+                self._cache[cnpj] = clinica_id
+                self._cache.move_to_end(cnpj)
+            while len(self._cache) > self.tamanho:
+                self._cache.popitem(last=False)
+
+    def _do_cache(self, cnpjs):
+        with self._lock:
+            ids = {}
+            for cnpj in cnpjs:
+                if cnpj in self._cache:
+                    self._cache.move_to_end(cnpj)
+                    ids[cnpj] = self._cache[cnpj]
+            return ids
+
+    def _buscar(self, cnpjs):
+        r = self.client.get(
+            "clinicas",
+            params={"select": "id,cnpj", "cnpj": _in_list(cnpjs)},
+        )
+        if r.status_code != 200:
+            raise RuntimeError(f"Erro ao buscar clinicas: {r.status_code} - {r.text}")
+        return {row["cnpj"]: row["id"] for row in r.json()}
+
+    def _criar(self, estabelecimentos):
+        payload = [
+            {
+                "cnpj": e["cnpj"],
+                "external_id": e.get("external_id"),
+                "nome": e.get("external_id") or e["cnpj"],
+            }
+            for e in estabelecimentos
+        ]
+        r = self.client.post(
+            "clinicas",
+            payload,
+            on_conflict="cnpj",
+            prefer="resolution=merge-duplicates,return=representation",
+        )
+        if r.status_code not in (200, 201):
+            raise RuntimeError(f"Erro ao criar clinicas: {r.status_code} - {r.text}")
+        return {row["cnpj"]: row["id"] for row in r.json()}
+
+    def resolver(self, estabelecimentos):
+        """
+        `estabelecimentos` é uma lista de {"cnpj", "external_id"};
+        retorna {cnpj: clinica_id} para todos eles.
+        """
+        por_cnpj = {e["cnpj"]: e for e in estabelecimentos if e.get("cnpj")}
+        if not por_cnpj:
+            return {}
+
+        ids = self._do_cache(por_cnpj)
+
+        faltando = [cnpj for cnpj in por_cnpj if cnpj not in ids]
+        if faltando:
+            encontrados = self._buscar(faltando)
+            novos = [por_cnpj[c] for c in faltando if c not in encontrados]
+            if novos:
+                encontrados.update(self._criar(novos))
+            self._guardar(encontrados)
+            ids.update(encontrados)
+
+        nao_resolvidos = set(por_cnpj) - set(ids)
+        if nao_resolvidos:
+            raise RuntimeError(
+                f"Não foi possível resolver as clínicas: {', '.join(sorted(nao_resolvidos))}"
+            )
+
+        return ids
+
+    def resolver_um(self, cnpj, external_id=None):
+        return self.resolver([{"cnpj": cnpj, "external_id": external_id}])[cnpj]
+
+    def invalidar(self, cnpj=None):
+        with self._lock:
+            if cnpj is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(cnpj, None)
+
+
+# ==========================
+# RESOLVEDOR PADRÃO (.env)
+# ==========================
+
+_resolvedor = None
+
+
+def get_resolvedor() -> ResolvedorClinicas:
+    """Resolvedor compartilhado pelo processo, sobre o cliente do .env."""
+    global _resolvedor
+
+    if _resolvedor is None:
+        _resolvedor = ResolvedorClinicas(get_client())
+
+    return _resolvedor
+
+
+def resolver_clinicas(estabelecimentos):
+    return get_resolvedor().resolver(estabelecimentos)
+
+
+def get_or_create_clinica(cnpj, external_id):
+    return get_resolvedor().resolver_um(cnpj, external_id)
@@ -0,0 +1,253 @@
+"""
+Política de crédito & risco sobre a vw_dashboard_final: uma única
+implementação (score, categoria, bases, fator e limite sugerido) usada pelo
+/dashboard e pelo /export-dashboard, calculada por coluna (uma linha por
+clínica × mês) em vez de linha a linha.
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# ==========================
+# HELPERS
+# ==========================
+
+def _coluna(df, col):
+    """Coluna como array float (None/texto inválido → NaN); ausente → tudo NaN."""
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+
+def _clamp01(x):
+    """Limita a [0, 1]; NaN vira 0 (mesma regra do cálculo linha a linha)."""
+    return np.where(np.isnan(x), 0.0, np.clip(x, 0.0, 1.0))
+
+
+# ==========================
+# SCORE AJUSTADO
+# ==========================
+
+def riscos(df):
+    """
+    Os quatro componentes de risco (0 = sem risco, 1 = risco máximo):
+      - inad:   inadimplência real sobre o emitido (0% → 0, 3%+ → 1)
+      - atraso: fora do vencimento (100% pago no venc. → 0, 25%+ fora → 1)
+      - dias:   prazo médio de pagamento (5 dias → 0, 65 dias+ → 1)
+      - parc:   parcelamento médio (1 parcela → 0, 12 parcelas+ → 1)
+    """
+    return {
+        "inad": _clamp01(_coluna(df, "taxa_inadimplencia_real") / 0.03),
+        "atraso": _clamp01((1.0 - _coluna(df, "taxa_pago_no_vencimento")) / 0.25),
+        "dias": _clamp01((_coluna(df, "tempo_medio_pagamento_dias") - 5.0) / 60.0),
+        "parc": _clamp01((_coluna(df, "parc_media_parcelas_pond") - 1.0) / 11.0),
+    }
+
+
+def calcular_score(df) -> pd.Series:
+    """
+    Score ajustado (0–1, maior é melhor) de cada linha. Pesos conservadores:
+    inad 50%, atraso 25%, dias 15%, parcelas 10%. As operações seguem a
+    mesma ordem da versão linha a linha, então o resultado é idêntico bit a bit.
+    """
+    r = riscos(df)
+    score = 1.0 - (
+        0.50 * r["inad"]
+        + 0.25 * r["atraso"]
+        + 0.15 * r["dias"]
+        + 0.10 * r["parc"]
+    )
+    return pd.Series(np.clip(score, 0.0, 1.0), index=df.index, dtype=float)
+
+
+def categoria_por_score(score) -> pd.Series:
+    """Categoria A–E pelo score (None onde não há score)."""
+    s = pd.to_numeric(score, errors="coerce")
+    categorias = np.select(
+        [s >= 0.80, s >= 0.60, s >= 0.40, s >= 0.20, s.notna()],
+        ["A", "B", "C", "D", "E"],
+        default=None,
+    )
+    return pd.Series(categorias, index=s.index)
+
+
+# ==========================
+# LIMITE SUGERIDO
+# ==========================
+
+LIMITE_TETO_GLOBAL = 3_000_000.0  # teto duro por clínica (ajustável)
+
+# Fator sobre a base mensal conforme o score do último mês da clínica
+FAIXAS_FATOR_LIMITE = [
+    (0.80, 0.90),
+    (0.70, 0.75),
+    (0.60, 0.60),
+    (0.50, 0.45),
+    (0.40, 0.35),
+    (0.20, 0.25),
+]
+FATOR_LIMITE_MINIMO = 0.15  # score abaixo de 0.20 ou ausente
+
+# Base mensal = média ponderada das bases de 12 meses, 3 meses e último mês
+PESOS_BASE = {"base_media12m": 0.50, "base_media3m": 0.30, "base_ultimo_mes": 0.20}
+
+# Trava: o limite não passa de 150% da maior base
+TETO_DINAMICO_BASES = 1.5
+
+
+def fator_limite(score):
+    s = np.asarray(pd.to_numeric(score, errors="coerce"), dtype=float)
+    return np.select(
+        [s >= minimo for minimo, _ in FAIXAS_FATOR_LIMITE],
+        [fator for _, fator in FAIXAS_FATOR_LIMITE],
+        default=FATOR_LIMITE_MINIMO,
+    )
+
+
+def limites_sugeridos(df, teto_global=LIMITE_TETO_GLOBAL) -> pd.DataFrame:
+    """
+    Limite sugerido de todas as clínicas de uma vez, indexado por clinica_id.
+
+    `df` é a view já tratada (clínica × mês, sem o mês em aberto, com
+    valor_total_emitido preenchido e score_ajustado). As janelas são
+    relativas ao último mês de cada clínica:
+      - base_media12m: emitido nos últimos 12 meses / meses com dado
+      - base_media3m: média do emitido nos últimos 3 meses
+      - base_ultimo_mes: emitido no último mês
+    O fator vem do score médio do último mês; o limite é base mensal × fator,
+    limitado a 150% da maior base e ao teto global. Também devolve o emitido
+    em 12 meses e a participação da clínica na carteira nessa mesma janela.
+    """
+    colunas = [
+        "ultimo_mes", *PESOS_BASE, "base_mensal_mix", "score_ultimo_mes", "fator",
+        "limite_sugerido", "emitido_12m", "share_portfolio_12m",
+    ]
+    if df.empty:
+        return pd.DataFrame(columns=colunas, index=pd.Index([], name="clinica_id"))
+
+    datas = df["mes_ref_date"]
+    valor = df["valor_total_emitido"]
+
+    # Fatoriza o id uma vez só; todos os groupby usam os códigos inteiros
+    codigos, ids = pd.factorize(df["clinica_id"])
+    clinica = pd.Series(codigos, index=df.index)
+
+    ultimo = datas.groupby(clinica).transform("max")
+    inicio_12m = ultimo - pd.DateOffset(months=11)
+    em_12m = datas >= inicio_12m
+    em_3m = (datas >= ultimo - pd.DateOffset(months=2)) & (datas <= ultimo)
+    no_ultimo = datas == ultimo
+
+    out = pd.DataFrame({"ultimo_mes": datas.groupby(clinica).max()})
+    out["emitido_12m"] = valor.where(em_12m).groupby(clinica).sum()
+    out["base_media12m"] = out["emitido_12m"] / datas.where(em_12m).groupby(clinica).nunique()
+    out["base_media3m"] = valor.where(em_3m).groupby(clinica).mean()
+    out["base_ultimo_mes"] = valor.where(no_ultimo).groupby(clinica).sum()
+    out["score_ultimo_mes"] = df["score_ajustado"].where(no_ultimo).groupby(clinica).mean()
+
+    # Média ponderada só entre as bases que existem
+    soma, pesos = 0.0, 0.0
+    for col, peso in PESOS_BASE.items():
+        ok = out[col].notna()
+        soma = soma + np.where(ok, out[col] * peso, 0.0)
+        pesos = pesos + np.where(ok, peso, 0.0)
+    mix = np.divide(soma, pesos, out=np.full(len(out), np.nan), where=pesos > 0)
+    out["base_mensal_mix"] = mix
+
+    out["fator"] = fator_limite(out["score_ultimo_mes"])
+    bruto = np.nan_to_num(mix, nan=0.0) * out["fator"]
+
+    maior_base = out[list(PESOS_BASE)].where(out[list(PESOS_BASE)] > 0).max(axis=1).fillna(0.0)
+    teto = TETO_DINAMICO_BASES * maior_base
+    out["limite_sugerido"] = np.minimum(np.minimum(bruto, teto), teto_global).where(bruto > 0)
+
+    # Participação na carteira: uma soma por início de janela distinto
+    inicio_clinica = out["ultimo_mes"] - pd.DateOffset(months=11)
+    carteira = {
+        ini: valor[datas >= ini].sum() for ini in inicio_clinica.unique()
+    }
+    total_carteira = inicio_clinica.map(carteira)
+    out["share_portfolio_12m"] = (out["emitido_12m"] / total_carteira).where(total_carteira > 0)
+
+    out = out.drop(index=-1, errors="ignore")  # linhas sem clinica_id
+    out.index = pd.Index(ids[out.index], name="clinica_id")
+    return out[colunas]
+
+
+# ==========================
+# POLÍTICA DA CARTEIRA
+# ==========================
+
+COLUNAS_NUMERICAS = [
+    "valor_total_emitido",
+    "taxa_pago_no_vencimento",
+    "taxa_inadimplencia",
+    "tempo_medio_pagamento_dias",
+    "parc_media_parcelas_pond",
+    "valor_medio_boleto",
+    "limite_aprovado",
+]
+
+
+def mes_em_aberto(agora=None):
+    """Primeiro dia do mês atual (UTC): daí em diante o mês ainda não fechou."""
+    agora = agora or datetime.utcnow()
+    return agora.replace(day=1, hour=0, minute=0, second=0, microsecond=0).date()
+
+
+def preparar_linhas(view, mes_aberto=None):
+    """
+    Linhas da view prontas para a política: só meses fechados, métricas
+    numéricas (emitido vazio = 0), inadimplência REAL sobre o emitido,
+    score ajustado e categoria. Não altera `view`.
+    """
+    mes_aberto = mes_aberto or mes_em_aberto()
+    df = view.copy()
+    if df.empty:
+        return df
+
+    origem = "mes_ref_date" if "mes_ref_date" in df.columns else "mes_ref"
+    df["mes_ref_date"] = pd.to_datetime(df[origem], errors="coerce")
+    df = df.dropna(subset=["mes_ref_date"])
+    df = df[df["mes_ref_date"].dt.date < mes_aberto].copy()
+
+    for col in COLUNAS_NUMERICAS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    if "valor_total_emitido" in df.columns:
+        df["valor_total_emitido"] = df["valor_total_emitido"].fillna(0)
+
+    for col in ("taxa_pago_no_vencimento", "taxa_inadimplencia"):
+        if col not in df.columns:
+            df[col] = 0.0
+
+    # Inadimplência REAL: parte não paga no vencimento × inadimplência dos atrasados
+    df["taxa_pago_no_vencimento"] = df["taxa_pago_no_vencimento"].clip(0, 1)
+    df["taxa_inad_dos_atrasados"] = df["taxa_inadimplencia"].clip(0, 1)
+    df["valor_nao_pago_no_venc"] = df["valor_total_emitido"] * (1 - df["taxa_pago_no_vencimento"])
+    df["valor_inad_real"] = df["valor_nao_pago_no_venc"] * df["taxa_inad_dos_atrasados"]
+    df["taxa_inadimplencia_real"] = (
+        df["valor_inad_real"] / df["valor_total_emitido"]
+    ).where(df["valor_total_emitido"] > 0)
+
+    df["score_ajustado"] = calcular_score(df)
+    df["categoria_risco_ajustada"] = categoria_por_score(df["score_ajustado"])
+
+    return df
+
+
+def avaliar_carteira(view, mes_aberto=None):
+    """
+    Aplica a política de crédito à carteira inteira de uma vez.
+
+    Devolve (linhas, clinicas): as linhas clínica × mês de preparar_linhas e
+    a tabela por clínica de limites_sugeridos com a categoria do score do
+    último mês. Os dois endpoints do dashboard leem daqui, calculado uma vez
+    por snapshot da view.
+    """
+    linhas = preparar_linhas(view, mes_aberto)
+    clinicas = limites_sugeridos(linhas)
+    clinicas["categoria_ultimo_mes"] = categoria_por_score(clinicas["score_ultimo_mes"])
+    return linhas, clinicas
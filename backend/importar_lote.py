@@ -0,0 +1,236 @@
+"""
+Importação em lote de uma pasta de planilhas (ex.: Clinicas/).
+
+    python importar_lote.py ../Clinicas --workers 8
+
+Etapas:
+  1. parse dos arquivos em paralelo (um processo por worker);
+  2. resolução de todos os CNPJs em uma única consulta;
+  3. merge das linhas de todos os arquivos por tabela e upsert em lotes
+     (PostgREST, ou COPY direto no Postgres com --backend copy);
+  4. registro das importações em um único POST.
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import carga_copy
+from clinicas import resolver_clinicas
+from processor import (
+    IMPORT_CONCORRENCIA,
+    TABELAS_CONFLITO,
+    dedupe,
+    ler_planilha,
+    payload_importacao,
+    preparar_registros,
+    registros_da_tabela,
+    supabase,
+    upsert_em_lotes,
+)
+
+
+# ==========================
+# ETAPAS
+# ==========================
+
+def _parse_arquivo(caminho):
+    """Roda no processo worker; nunca levanta, devolve o erro junto."""
+    try:
+        with open(caminho, "rb") as f:
+            contents = f.read()
+        sha256 = hashlib.sha256(contents).hexdigest()
+        parsed = ler_planilha(contents, sha256)
+        parsed["sha256"] = sha256
+        return caminho, parsed, None
+    except Exception as e:
+        return caminho, None, str(e)
+
+
+def parse_arquivos(caminhos, workers):
+    parsed, erros = {}, {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for caminho, resultado, erro in pool.map(_parse_arquivo, caminhos, chunksize=4):
+            if erro:
+                erros[caminho] = erro
+            else:
+                parsed[caminho] = resultado
+
+    return parsed, erros
+
+
+def juntar_tabelas(parsed, ids):
+    """
+    Linhas de todos os arquivos por tabela, já com clinica_id e sem duplicatas.
+
+    Se vários arquivos trazem a mesma clínica e mês, vale o último na ordem
+    dos caminhos, o mesmo resultado de importá-los um a um (o upsert
+    sobrescreve).
+    """
+    tabelas = {tabela: [] for tabela in TABELAS_CONFLITO}
+    contagens = {}
+
+    for caminho, dados in parsed.items():
+        clinica_id = ids[dados["estabelecimento"]["cnpj"]]
+        contagens[caminho] = {}
+
+        for tabela, conflict in TABELAS_CONFLITO.items():
+            registros = registros_da_tabela(dados, tabela)
+            contagens[caminho][tabela] = len(registros)
+            tabelas[tabela].extend(preparar_registros(registros, clinica_id, conflict))
+
+    for tabela, conflict in TABELAS_CONFLITO.items():
+        conflict_cols = [c.strip() for c in conflict.split(",")]
+        tabelas[tabela] = dedupe(tabelas[tabela], conflict_cols, manter_ultimo=True)
+
+    return tabelas, contagens
+
+
+def enviar_tabelas_lote(tabelas, tamanho=None, concorrencia=IMPORT_CONCORRENCIA):
+    """Retorna (enviados, rejeitadas) — linhas recusadas não abortam o lote."""
+    with ThreadPoolExecutor(max_workers=max(1, concorrencia)) as pool:
+        futuros = {
+            tabela: pool.submit(upsert_em_lotes, tabela, registros, TABELAS_CONFLITO[tabela], tamanho)
+            for tabela, registros in tabelas.items()
+            if registros
+        }
+
+        enviados, rejeitadas = {}, []
+        for tabela, f in futuros.items():
+            recusadas, _ = f.result()
+            enviados[tabela] = len(tabelas[tabela]) - len(recusadas)
+            rejeitadas.extend({"tabela": tabela, **r} for r in recusadas)
+
+    return enviados, rejeitadas
+
+
+def registrar_importacoes(parsed, ids, contagens, rejeitadas):
+    por_clinica = {}
+    for r in rejeitadas:
+        por_clinica.setdefault(r["linha"]["clinica_id"], []).append(r)
+
+    payload = []
+    for caminho, dados in parsed.items():
+        clinica_id = ids[dados["estabelecimento"]["cnpj"]]
+        # recusas da clínica vão para o primeiro arquivo dela
+        recusadas = por_clinica.pop(clinica_id, [])
+        payload.append(
+            payload_importacao(
+                clinica_id, os.path.basename(caminho), contagens[caminho], recusadas, dados["sha256"]
+            )
+        )
+
+    r = supabase.post("importacoes", payload, idempotente=False)
+    if r.status_code not in (200, 201):
+        raise RuntimeError(f"Erro ao registrar importações: {r.status_code} - {r.text}")
+
+
+# ==========================
+# MAIN
+# ==========================
+
+def importar_pasta(pasta, workers=None, tamanho=None, backend="postgrest"):
+    caminhos = sorted(glob.glob(os.path.join(pasta, "*.xlsx")))
+    if not caminhos:
+        raise RuntimeError(f"Nenhum .xlsx encontrado em {pasta}")
+
+    # conecta antes do parse para falhar cedo se o Postgres não estiver acessível
+    conn = carga_copy.conectar() if backend == "copy" else None
+    try:
+        return _importar(caminhos, workers, tamanho, conn)
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def _importar(caminhos, workers, tamanho, conn):
+    """Etapas de importar_pasta; `conn` só vem com o backend copy."""
+    tempos = {}
+    inicio = time.perf_counter()
+
+    t0 = time.perf_counter()
+    parsed, erros = parse_arquivos(caminhos, workers or os.cpu_count())
+    tempos["parse"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ids = resolver_clinicas([d["estabelecimento"] for d in parsed.values()])
+    tempos["clinicas"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    tabelas, contagens = juntar_tabelas(parsed, ids)
+    tempos["merge"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if conn is not None:
+        # uma transação só: se falhar, nada foi gravado e a exceção sobe
+        enviados, rejeitadas = carga_copy.copiar_tabelas(tabelas, TABELAS_CONFLITO, tamanho, conn), []
+    else:
+        enviados, rejeitadas = enviar_tabelas_lote(tabelas, tamanho)
+    tempos["upsert"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if parsed:
+        registrar_importacoes(parsed, ids, contagens, rejeitadas)
+    tempos["registro"] = time.perf_counter() - t0
+
+    tempos["total"] = time.perf_counter() - inicio
+
+    return {
+        "arquivos": len(caminhos),
+        "importados": len(parsed),
+        "erros": erros,
+        "clinicas": len(ids),
+        "linhas": enviados,
+        "rejeitadas": rejeitadas,
+        "tempos": tempos,
+    }
+
+
+def imprimir_relatorio(resumo):
+    tempos = resumo["tempos"]
+    total = tempos["total"] or 1e-9
+    linhas = sum(resumo["linhas"].values())
+
+    print(f"\n📦 Arquivos: {resumo['importados']}/{resumo['arquivos']} importados · {resumo['clinicas']} clínicas")
+    print(f"⚡ {resumo['importados'] / total:.1f} arquivos/s · {linhas / total:.0f} linhas/s · {linhas} linhas em {total:.2f}s")
+
+    print("\n⏱️  Tempo por etapa:")
+    for etapa, t in tempos.items():
+        if etapa != "total":
+            print(f"   {etapa:<10} {t:8.2f}s  ({t / total:5.1%})")
+
+    print("\n📊 Linhas por tabela:")
+    for tabela, n in resumo["linhas"].items():
+        print(f"   {tabela:<26} {n}")
+
+    if resumo["rejeitadas"]:
+        print(f"\n⚠️  {len(resumo['rejeitadas'])} linhas rejeitadas pelo banco:")
+        for r in resumo["rejeitadas"][:20]:
+            print(f"   {r['tabela']} {r['linha'].get('mes_ref')}: {r['erro']}")
+
+    for caminho, erro in resumo["erros"].items():
+        print(f"\n❌ {os.path.basename(caminho)}: {erro}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa todas as planilhas de uma pasta.")
+    parser.add_argument("pasta")
+    parser.add_argument("--workers", type=int, default=None, help="processos de parse (padrão: nº de CPUs)")
+    parser.add_argument("--lote", type=int, default=None, help="máximo de linhas por upsert/transação")
+    parser.add_argument(
+        "--backend",
+        choices=("postgrest", "copy"),
+        default="postgrest",
+        help="copy = COPY + INSERT ON CONFLICT direto no Postgres (SUPABASE_DB_URL)",
+    )
+    args = parser.parse_args()
+
+    resumo = importar_pasta(args.pasta, workers=args.workers, tamanho=args.lote, backend=args.backend)
+    imprimir_relatorio(resumo)
+
+    sys.exit(1 if resumo["erros"] else 0)
@@ -0,0 +1,262 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from cache_dashboard import invalidar_dashboard
+from processor import processar_excel
+
+# ==========================
+# CONFIG
+# ==========================
+
+# Quantos arquivos são processados ao mesmo tempo (cada um decodifica o Excel
+# inteiro em memória) e quantos podem esperar na fila antes de recusarmos.
+UPLOAD_MAX_WORKERS = int(os.getenv("UPLOAD_MAX_WORKERS", "2"))
+UPLOAD_MAX_PENDENTES = int(os.getenv("UPLOAD_MAX_PENDENTES", "20"))
+
+# Jobs finalizados ficam disponíveis para consulta por este tempo
+UPLOAD_JOB_TTL = int(os.getenv("UPLOAD_JOB_TTL", "3600"))
+
+# Uploads vão direto para o disco; nada acima deste tamanho é aceito
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "50"))
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or tempfile.gettempdir()
+UPLOAD_BLOCO = 1024 * 1024
+
+# Pico de memória estimado de um job = tamanho do .xlsx × fator (XML
+# descompactado + objetos Python das células). Arquivos cuja estimativa
+# passa do alvo por job são recusados; jobs só começam enquanto a soma
+# das estimativas em andamento couber no orçamento total.
+UPLOAD_FATOR_MEMORIA = float(os.getenv("UPLOAD_FATOR_MEMORIA", "15"))
+UPLOAD_MEMORIA_JOB_MB = float(os.getenv("UPLOAD_MEMORIA_JOB_MB", "768"))
+UPLOAD_MEMORIA_TOTAL_MB = float(
+    os.getenv("UPLOAD_MEMORIA_TOTAL_MB", str(UPLOAD_MEMORIA_JOB_MB * UPLOAD_MAX_WORKERS))
+)
+
+
+class FilaCheiaError(RuntimeError):
+    pass
+
+
+class UploadGrandeError(ValueError):
+    pass
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=UPLOAD_MAX_WORKERS,
+    thread_name_prefix="upload",
+)
+_jobs: dict[str, dict] = {}
+_lock = threading.Lock()
+
+_memoria_em_uso = 0.0
+_memoria_livre = threading.Condition()
+
+
+# ==========================
+# HELPERS
+# ==========================
+
+def _agora():
+    return datetime.utcnow().isoformat()
+
+
+def _pendentes():
+    return sum(1 for j in _jobs.values() if j["estado"] in ("na_fila", "processando"))
+
+
+def _limpar_antigos():
+    limite = time.time() - UPLOAD_JOB_TTL
+    for job_id in [
+        k for k, j in _jobs.items()
+        if j.get("_finalizado_ts") and j["_finalizado_ts"] < limite
+    ]:
+        del _jobs[job_id]
+
+
+def _publico(job):
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+def _estimar_memoria_mb(tamanho):
+    return tamanho * UPLOAD_FATOR_MEMORIA / (1024 * 1024)
+
+
+def _remover(caminho):
+    try:
+        os.remove(caminho)
+    except OSError:
+        pass
+
+
+def _reservar_memoria(mb):
+    """Bloqueia até o job caber no orçamento (um job sozinho sempre cabe)."""
+    global _memoria_em_uso
+
+    with _memoria_livre:
+        while _memoria_em_uso > 0 and _memoria_em_uso + mb > UPLOAD_MEMORIA_TOTAL_MB:
+            _memoria_livre.wait()
+        _memoria_em_uso += mb
+
+
+def _liberar_memoria(mb):
+    global _memoria_em_uso
+
+    with _memoria_livre:
+        _memoria_em_uso -= mb
+        _memoria_livre.notify_all()
+
+
+# ==========================
+# RECEBIMENTO
+# ==========================
+
+async def receber_upload(file):
+    """
+    Copia o corpo do upload para um arquivo temporário em blocos de 1 MB,
+    calculando o SHA-256 no caminho, sem manter o arquivo inteiro em
+    memória. Retorna (caminho, tamanho, sha256).
+
+    Levanta UploadGrandeError se passar de UPLOAD_MAX_MB ou se o pico de
+    memória estimado para processá-lo passar de UPLOAD_MEMORIA_JOB_MB.
+    """
+    limite = UPLOAD_MAX_MB * 1024 * 1024
+    h = hashlib.sha256()
+    tamanho = 0
+
+    fd, caminho = tempfile.mkstemp(prefix="upload_", suffix=".xlsx", dir=UPLOAD_TMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as destino:
+            while bloco := await file.read(UPLOAD_BLOCO):
+                tamanho += len(bloco)
+                if tamanho > limite:
+                    raise UploadGrandeError(
+                        f"Arquivo maior que o limite de {UPLOAD_MAX_MB:g} MB."
+                    )
+                h.update(bloco)
+                destino.write(bloco)
+
+        if _estimar_memoria_mb(tamanho) > UPLOAD_MEMORIA_JOB_MB:
+            raise UploadGrandeError(
+                "Arquivo grande demais para processar com o limite de memória "
+                f"de {UPLOAD_MEMORIA_JOB_MB:g} MB por importação."
+            )
+    except BaseException:
+        _remover(caminho)
+        raise
+
+    return caminho, tamanho, h.hexdigest()
+
+
+# ==========================
+# API DE JOBS
+# ==========================
+
+def criar_job(
+    caminho: str,
+    arquivo_nome: str,
+    tamanho: int,
+    sha256: str = None,
+    forcar: bool = False,
+    incremental=None,
+):
+    """
+    Enfileira o processamento do arquivo salvo em `caminho` (vindo de
+    receber_upload) e retorna o job imediatamente. O job passa a ser dono
+    do arquivo temporário e o apaga ao terminar.
+
+    Levanta FilaCheiaError se já houver UPLOAD_MAX_PENDENTES na fila.
+    `forcar` reprocessa mesmo que o arquivo idêntico já tenha sido importado;
+    `incremental` sobrescreve IMPORT_INCREMENTAL.
+    """
+    with _lock:
+        _limpar_antigos()
+
+        if _pendentes() >= UPLOAD_MAX_PENDENTES:
+            _remover(caminho)
+            raise FilaCheiaError(
+                "Fila de importação cheia, tente novamente em instantes."
+            )
+
+        job_id = str(uuid.uuid4())
+        job = {
+            "id": job_id,
+            "arquivo": arquivo_nome,
+            "tamanho": tamanho,
+            "estado": "na_fila",
+            "criado_em": _agora(),
+            "iniciado_em": None,
+            "finalizado_em": None,
+            "registros": None,
+            "tabelas": None,
+            "tempos": None,
+            "resultado": None,
+            "erro": None,
+            "_criado_ts": time.perf_counter(),
+        }
+        _jobs[job_id] = job
+        publico = _publico(job)
+
+    _executor.submit(_executar, job_id, caminho, tamanho, sha256, forcar, incremental)
+    return publico
+
+
+def obter_job(job_id: str):
+    with _lock:
+        job = _jobs.get(job_id)
+        return _publico(job) if job else None
+
+
+def _executar(job_id, caminho, tamanho, sha256=None, forcar=False, incremental=None):
+    memoria = _estimar_memoria_mb(tamanho)
+    _reservar_memoria(memoria)
+
+    with _lock:
+        job = _jobs[job_id]
+        job["estado"] = "processando"
+        job["iniciado_em"] = _agora()
+        inicio = time.perf_counter()
+        espera = inicio - job["_criado_ts"]
+
+    try:
+        resultado = processar_excel(
+            caminho,
+            arquivo_nome=job["arquivo"],
+            forcar=forcar,
+            incremental=incremental,
+            sha256=sha256,
+        )
+        erro = None
+        tabelas = resultado.get("tabelas")
+    except Exception as e:
+        resultado = None
+        erro = f"Erro ao processar o arquivo: {e}"
+        tabelas = getattr(e, "resumo", None)
+    finally:
+        _liberar_memoria(memoria)
+        _remover(caminho)
+
+    # Algo pode ter sido gravado (mesmo com erro no meio): o dashboard recarrega
+    if not resultado or resultado.get("status") != "duplicado":
+        invalidar_dashboard()
+
+    with _lock:
+        job["estado"] = "erro" if erro else "concluido"
+        job["finalizado_em"] = _agora()
+        job["_finalizado_ts"] = time.time()
+        job["erro"] = erro
+        job["resultado"] = resultado
+        job["tabelas"] = tabelas
+
+        tempos = {
+            "fila": round(espera, 3),
+            "processamento": round(time.perf_counter() - inicio, 3),
+        }
+        if resultado:
+            job["registros"] = resultado.get("registros")
+            tempos.update(resultado.get("tempos") or {})
+        job["tempos"] = tempos
@@ -1,13 +1,14 @@
-import os
-import math
+import asyncio
 from datetime import datetime
 import pandas as pd
-import requests
 from fastapi import FastAPI, File, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-from processor import processar_excel
+from cache_dashboard import carregar_view, get_snapshot, invalidar_dashboard, tipar
+from credito import LIMITE_TETO_GLOBAL, avaliar_carteira, mes_em_aberto
+from jobs import FilaCheiaError, UploadGrandeError, criar_job, obter_job, receber_upload
+from supabase_client import close_async_client, get_async_client
 
 
 
@@ -16,29 +17,6 @@ from openpyxl import Workbook
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import StreamingResponse
 
-# ==========================
-# CONFIG SUPABASE
-# ==========================
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-
-if not SUPABASE_URL:
-    raise RuntimeError("⚠️ Defina SUPABASE_URL no .env")
-
-# remover "db." se vier na URL
-if "db." in SUPABASE_URL:
-    SUPABASE_URL = SUPABASE_URL.replace("db.", "")
-
-if not SERVICE_ROLE_KEY:
-    raise RuntimeError("⚠️ Defina SUPABASE_SERVICE_ROLE_KEY no .env")
-
-HEADERS = {
-    "apikey": SERVICE_ROLE_KEY,
-    "Authorization": f"Bearer {SERVICE_ROLE_KEY}",
-    "Content-Type": "application/json",
-}
-
 class LimiteAprovadoPayload(BaseModel):
     limite_aprovado: float | None = None
     observacao: str | None = None
@@ -153,6 +131,11 @@ app.add_middleware(
 )
 
 
+@app.on_event("shutdown")
+async def fechar_clientes():
+    await close_async_client()
+
+
 @app.get("/")
 def read_root():
     return {"status": "ok"}
@@ -164,17 +147,14 @@ def read_root():
 # ==========================
 
 
-def supabase_post(table: str, data: dict, on_conflict: str | None = None):
-    url = f"{SUPABASE_URL}/rest/v1/{table}"
-    params = {}
-    if on_conflict:
-        params["on_conflict"] = on_conflict
-
-    r = requests.post(
-        url,
-        headers={**HEADERS, "Prefer": "return=representation"},
-        params=params,
-        json=data,
+async def supabase_post_async(table: str, data: dict, on_conflict: str | None = None):
+    """POST no PostgREST pelo AsyncSupabaseClient, sem bloquear o event loop; devolve a primeira linha gravada (ou None)."""
+    r = await get_async_client().post(
+        table,
+        data,
+        on_conflict=on_conflict,
+        prefer="return=representation",
+        idempotente=on_conflict is not None,
     )
 
     if r.status_code not in (200, 201):
@@ -186,15 +166,13 @@ def supabase_post(table: str, data: dict, on_conflict: str | None = None):
         return None
 
 
-def supabase_get(table: str, select: str = "*", extra_params: dict | None = None):
-    """GET simples no PostgREST, retornando lista de dicts."""
-    url = f"{SUPABASE_URL}/rest/v1/{table}"
-
+async def supabase_get_async(table: str, select: str = "*", extra_params: dict | None = None):
+    """GET no PostgREST sem bloquear o event loop (use com asyncio.gather); lista de dicts."""
     params = {"select": select}
     if extra_params:
         params.update(extra_params)
 
-    r = requests.get(url, headers=HEADERS, params=params)
+    r = await get_async_client().get(table, params=params)
 
     if r.status_code not in (200, 206):
         raise RuntimeError(f"Erro ao buscar {table}: {r.status_code} - {r.text}")
@@ -219,20 +197,47 @@ def ping():
     return {"status": "ok"}
 
 
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+@app.post("/upload", status_code=202)
+async def upload_file(
+    file: UploadFile = File(...),
+    forcar: bool = False,
+    incremental: Optional[bool] = None,
+):
     """
-    Recebe um arquivo Excel (.xlsx), processa e insere os dados no Supabase.
+    Recebe um arquivo Excel (.xlsx) e agenda o processamento em background.
+    Retorna o job criado; o andamento fica em GET /upload/jobs/{id}.
+    Um arquivo idêntico a outro já importado sem erros termina com status "duplicado",
+    a menos que `?forcar=true`. `?incremental=true` envia só os meses que
+    mudaram em relação ao banco (padrão: IMPORT_INCREMENTAL, desligado).
     """
     try:
-        contents = await file.read()
-        resultado = processar_excel(contents, arquivo_nome=file.filename)
-        return resultado
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Erro ao processar o arquivo: {e}",
+        caminho, tamanho, sha256 = await receber_upload(file)
+    except UploadGrandeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    try:
+        return criar_job(
+            caminho,
+            arquivo_nome=file.filename,
+            tamanho=tamanho,
+            sha256=sha256,
+            forcar=forcar,
+            incremental=incremental,
         )
+    except FilaCheiaError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+
+@app.get("/upload/jobs/{job_id}")
+async def status_upload(job_id: str):
+    """
+    Estado de um job de importação: na_fila, processando, concluido ou erro,
+    com a contagem por tabela e os tempos de cada etapa.
+    """
+    job = obter_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job de importação não encontrado.")
+    return job
 
 
 @app.post("/clinicas/{clinica_id}/limite_aprovado")
@@ -257,10 +262,12 @@ async def definir_limite_aprovado(clinica_id: str, payload: LimiteAprovadoPayloa
 
 
     try:
-        inserido = supabase_post("clinica_limite", row)
+        inserido = await supabase_post_async("clinica_limite", row)
     except RuntimeError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    invalidar_dashboard()
+
     return {"ok": True, "registro": inserido}
 
 
@@ -271,7 +278,7 @@ async def listar_limites_clinica(clinica_id: str):
     do mais recente para o mais antigo.
     """
     try:
-        rows = supabase_get(
+        rows = await supabase_get_async(
             "clinica_limite",
             select=(
                 "limite_aprovado,"
@@ -309,10 +316,10 @@ async def listar_historico():
 
     # 1) Buscar importações + clínica
     try:
-        importacoes = supabase_get(
+        importacoes = await supabase_get_async(
             "importacoes",
             select=(
-                "id,clinica_id,arquivo_nome,total_linhas,status,criado_em,"
+                "id,clinica_id,arquivo_nome,total_linhas,erros,avisos,status,criado_em,"
                 "clinicas:clinica_id(id,nome,cnpj,external_id)"
             ),
             extra_params={"order": "criado_em.desc"},
@@ -337,14 +344,23 @@ async def listar_historico():
     if clinica_ids:
         ids_in = ",".join(clinica_ids)
 
-        # 2.1 Boletos emitidos
-        try:
-            boletos_rows = supabase_get(
+        # 2.1 Boletos emitidos e 2.2 inadimplência REAL, buscados juntos; da
+        # view vêm só as clínicas do histórico, os meses fechados e 5 colunas
+        boletos_rows, view_rows = await asyncio.gather(
+            supabase_get_async(
                 "boletos_emitidos",
                 select="clinica_id,qtde",
                 extra_params={"clinica_id": f"in.({ids_in})"},
-            )
-        except Exception:
+            ),
+            carregar_view(
+                ["clinica_id", "mes_ref_date", "valor_total_emitido",
+                 "taxa_pago_no_vencimento", "taxa_inadimplencia"],
+                clinica_id=clinica_ids,
+                fim=mes_em_aberto(),
+            ),
+            return_exceptions=True,
+        )
+        if isinstance(boletos_rows, Exception):
             boletos_rows = []
 
         # Agregar boletos (soma)
@@ -361,32 +377,11 @@ async def listar_historico():
                 totais_boletos_por_clinica.get(cid, 0) + qtde
             )
 
-        # 2.2 Inadimplência REAL
-        try:
-            dash_rows = supabase_get(
-                "vw_dashboard_final",
-                select="clinica_id,mes_ref_date,valor_total_emitido,taxa_pago_no_vencimento,taxa_inadimplencia",
-                extra_params={"clinica_id": f"in.({ids_in})"},
-            )
-        except Exception:
-            dash_rows = []
-
-        df_dash = to_df(dash_rows)
+        df_dash = pd.DataFrame()
+        if not isinstance(view_rows, Exception):
+            df_dash = tipar(view_rows)
 
         if not df_dash.empty:
-            # Ignorar mês atual
-            hoje_utc = datetime.utcnow()
-            primeiro_dia_mes_atual = hoje_utc.replace(
-                day=1, hour=0, minute=0, second=0, microsecond=0
-            ).date()
-            if "mes_ref_date" in df_dash.columns:
-                df_dash["mes_ref_date"] = pd.to_datetime(
-                    df_dash["mes_ref_date"], errors="coerce"
-                )
-                df_dash = df_dash[
-                    df_dash["mes_ref_date"].dt.date < primeiro_dia_mes_atual
-                ]
-
             # Tipos numéricos e preenchimento de nulos
             for col in [
                 "valor_total_emitido",
@@ -460,14 +455,20 @@ async def dashboard_resumo_geral():
     """
 
     try:
-        # --- Tabelas base ---
-        boletos_rows = supabase_get(
-            "boletos_emitidos", select="mes_ref,qtde,valor_total"
+        # --- Tabelas base (independentes, buscadas em paralelo) ---
+        (
+            boletos_rows,
+            inad_rows,
+            taxa_venc_rows,
+            tempo_rows,
+            ticket_rows,
+        ) = await asyncio.gather(
+            supabase_get_async("boletos_emitidos", select="mes_ref,qtde,valor_total"),
+            supabase_get_async("inadimplencia", select="mes_ref,taxa"),
+            supabase_get_async("taxa_pago_no_vencimento", select="mes_ref,taxa"),
+            supabase_get_async("tempo_medio_pagamento", select="mes_ref,dias"),
+            supabase_get_async("valor_medio_boleto", select="mes_ref,valor"),
         )
-        inad_rows = supabase_get("inadimplencia", select="mes_ref,taxa")
-        taxa_venc_rows = supabase_get("taxa_pago_no_vencimento", select="mes_ref,taxa")
-        tempo_rows = supabase_get("tempo_medio_pagamento", select="mes_ref,dias")
-        ticket_rows = supabase_get("valor_medio_boleto", select="mes_ref,valor")
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Erro ao carregar dados do Supabase: {e}"
@@ -652,24 +653,18 @@ async def listar_clinicas_dashboard():
     para uso no filtro do dashboard de crédito & risco.
     """
     try:
-        rows = supabase_get(
-            "vw_dashboard_final",
-            select="clinica_id,clinica_nome,cnpj,external_id",
-        )
+        df = await get_snapshot().obter()
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Erro ao carregar clínicas do dashboard: {e}",
         )
 
-    df = to_df(
-        rows,
-        columns=["clinica_id", "clinica_nome", "cnpj", "external_id"],
-    )
-
     if df.empty:
         return []
 
+    df = df.reindex(columns=["clinica_id", "clinica_nome", "cnpj", "external_id"])
+
     df = df.drop_duplicates(subset=["clinica_id"])
 
     clinicas = []
@@ -689,23 +684,14 @@ async def listar_clinicas_dashboard():
     return clinicas
 
 
-def _fator_limite_score(s):
-    s = _safe_float(s)
-    if s is None:
-        return 0.15
-    if s >= 0.80:
-        return 0.90
-    if s >= 0.70:
-        return 0.75
-    if s >= 0.60:
-        return 0.60
-    if s >= 0.50:
-        return 0.45
-    if s >= 0.40:
-        return 0.35
-    if s >= 0.20:
-        return 0.25
-    return 0.15
+async def _carteira():
+    """(linhas, clinicas) de credito.avaliar_carteira, calculado uma vez por snapshot e mês."""
+    mes_aberto = mes_em_aberto()
+    return await get_snapshot().derivado(
+        ("carteira", mes_aberto),
+        lambda view: avaliar_carteira(view, mes_aberto),
+    )
+
 
 @app.get("/dashboard", response_model=DashboardData)
 async def dashboard_completo(
@@ -729,20 +715,17 @@ async def dashboard_completo(
     """
 
     # --------------------------
-    # 1) Carregar dados da view
+    # 1) Carregar dados da view (snapshot em memória)
     # --------------------------
-    extra = {}
     try:
-        rows = supabase_get("vw_dashboard_final", select="*", extra_params=extra)
+        view = await get_snapshot().obter()
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Erro ao carregar dados do dashboard: {e}",
         )
 
-    df = to_df(rows)
-
-    if df.empty:
+    if view.empty:
         return {
             "filtros": {"periodo": {"min_mes_ref": None, "max_mes_ref": None}},
             "contexto": {
@@ -755,19 +738,10 @@ async def dashboard_completo(
         }
 
     # --------------------------
-    # 2) Preparar datas
+    # 2) a 5) Política de crédito (credito.py): meses fechados, inadimplência
+    # REAL, score/categoria por linha e limite por clínica, uma vez por snapshot
     # --------------------------
-    if "mes_ref_date" in df.columns:
-        df["mes_ref_date"] = pd.to_datetime(df["mes_ref_date"], errors="coerce")
-    else:
-        df["mes_ref_date"] = pd.to_datetime(df["mes_ref"], errors="coerce")
-
-    df = df.dropna(subset=["mes_ref_date"])
-
-    # Ignorar sempre o mês em aberto (mês atual)
-    hoje_utc = datetime.utcnow()
-    primeiro_dia_mes_atual = hoje_utc.replace(day=1, hour=0, minute=0, second=0, microsecond=0).date()
-    df = df[df["mes_ref_date"].dt.date < primeiro_dia_mes_atual]
+    df, limites = await _carteira()
 
     if df.empty:
         return {
@@ -781,112 +755,6 @@ async def dashboard_completo(
             "ranking_clinicas": [],
         }
 
-    # --------------------------
-    # 3) Tipos numéricos
-    # --------------------------
-    def _num(col, fill=None):
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-            if fill is not None:
-                df[col] = df[col].fillna(fill)
-
-    _num("valor_total_emitido", fill=0)
-    _num("taxa_pago_no_vencimento")
-    _num("taxa_inadimplencia")
-    _num("tempo_medio_pagamento_dias")
-    _num("parc_media_parcelas_pond")
-    _num("valor_medio_boleto")
-    _num("limite_aprovado")
-
-    # --------------------------
-    # 4) Inadimplência REAL
-    # --------------------------
-    if "taxa_pago_no_vencimento" not in df.columns:
-        df["taxa_pago_no_vencimento"] = 0.0
-    if "taxa_inadimplencia" not in df.columns:
-        df["taxa_inadimplencia"] = 0.0
-
-    df["taxa_pago_no_vencimento"] = df["taxa_pago_no_vencimento"].clip(0, 1)
-    df["taxa_inad_dos_atrasados"] = df["taxa_inadimplencia"].clip(0, 1)
-
-    df["valor_nao_pago_no_venc"] = df["valor_total_emitido"] * (
-        1 - df["taxa_pago_no_vencimento"]
-    )
-    df["valor_inad_real"] = df["valor_nao_pago_no_venc"] * df["taxa_inad_dos_atrasados"]
-
-    df["taxa_inadimplencia_real"] = None
-    mask_emitido = df["valor_total_emitido"] > 0
-    df.loc[mask_emitido, "taxa_inadimplencia_real"] = (
-        df.loc[mask_emitido, "valor_inad_real"] / df.loc[mask_emitido, "valor_total_emitido"]
-    )
-
-    # --------------------------
-    # 5) SCORE AJUSTADO
-    # --------------------------
-    def _clamp01(x):
-        try:
-            x = float(x)
-        except Exception:
-            return 0.0
-        if math.isnan(x):
-            return 0.0
-        return max(0.0, min(1.0, x))
-
-    def _calc_score_row(row):
-        inad_real = row.get("taxa_inadimplencia_real")  # sobre o total emitido
-        pago_venc = row.get("taxa_pago_no_vencimento")  # 0–1
-        dias = row.get("tempo_medio_pagamento_dias")
-        parc = row.get("parc_media_parcelas_pond")
-
-        # 1) Risco de inadimplência real (0 → 0%, 1 → 3%+)
-        risk_inad = 0.0
-        if inad_real is not None:
-            risk_inad = _clamp01(inad_real / 0.03)  # 3% vira risco 1
-
-        # 2) Risco de atraso (0 → 100% pago no venc., 1 → 25%+ fora do venc.)
-        risk_atraso = 0.0
-        if pago_venc is not None:
-            risk_atraso = _clamp01((1.0 - float(pago_venc)) / 0.25)
-
-        # 3) Risco de prazo (0 → 5 dias, 1 → 65 dias+)
-        risk_dias = 0.0
-        if dias is not None:
-            risk_dias = _clamp01((float(dias) - 5.0) / 60.0)
-
-        # 4) Risco de parcelamento (0 → 1 parcela, 1 → 12 parcelas+)
-        risk_parc = 0.0
-        if parc is not None:
-            risk_parc = _clamp01((float(parc) - 1.0) / 11.0)
-
-        # Pesos conservadores:
-        # inad 50%, atraso 25%, dias 15%, parcelas 10%
-        score = 1.0 - (
-            0.50 * risk_inad
-            + 0.25 * risk_atraso
-            + 0.15 * risk_dias
-            + 0.10 * risk_parc
-        )
-
-        return max(0.0, min(1.0, score))
-
-    df["score_ajustado"] = df.apply(_calc_score_row, axis=1)
-
-    def _categoria_from_score(s):
-        s = _safe_float(s)
-        if s is None:
-            return None
-        if s >= 0.80:
-            return "A"
-        if s >= 0.60:
-            return "B"
-        if s >= 0.40:
-            return "C"
-        if s >= 0.20:
-            return "D"
-        return "E"
-
-    df["categoria_risco_ajustada"] = df["score_ajustado"].apply(_categoria_from_score)
-
     # --------------------------
     # 6) Período global
     # --------------------------
@@ -1103,103 +971,16 @@ async def dashboard_completo(
     limite_sugerido_fator = None
     limite_sugerido_share_portfolio_12m = None
 
-    LIMITE_TETO_GLOBAL = 3_000_000.0  # teto duro por clínica (ajustável)
-
-    if clinica_id:
-        df_clin_all = df[df["clinica_id"] == clinica_id].copy()
-        if not df_clin_all.empty:
-            last_dt_clin = df_clin_all["mes_ref_date"].max()
-
-            # 10.1 Janela 12M da clínica
-            dt_inicio_12m_clin = last_dt_clin - pd.DateOffset(months=11)
-            df_clin_12m = df_clin_all[
-                df_clin_all["mes_ref_date"] >= dt_inicio_12m_clin
-            ].copy()
-            if df_clin_12m.empty:
-                df_clin_12m = df_clin_all.copy()
-
-            total_emit_12m_clin = _safe_float(df_clin_12m["valor_total_emitido"].sum())
-            n_meses_12m_clin = int(df_clin_12m["mes_ref_date"].nunique() or 0)
-
-            if n_meses_12m_clin > 0 and total_emit_12m_clin is not None:
-                limite_sugerido_base_media12m = total_emit_12m_clin / n_meses_12m_clin
-
-            # 10.2 Janela 3M da clínica
-            dt_inicio_3m = last_dt_clin - pd.DateOffset(months=2)
-            df_last3 = df_clin_all[
-                (df_clin_all["mes_ref_date"] >= dt_inicio_3m)
-                & (df_clin_all["mes_ref_date"] <= last_dt_clin)
-            ].copy()
-            if not df_last3.empty:
-                limite_sugerido_base_media3m = _safe_float(
-                    df_last3["valor_total_emitido"].mean()
-                )
-
-            # 10.3 Último mês da clínica
-            df_ultimo_mes_clin = df_clin_all[
-                df_clin_all["mes_ref_date"] == last_dt_clin
-            ].copy()
-            if not df_ultimo_mes_clin.empty:
-                limite_sugerido_base_ultimo_mes = _safe_float(
-                    df_ultimo_mes_clin["valor_total_emitido"].sum()
-                )
-
-            # 10.4 Base mensal combinada (12M, 3M, último mês)
-            componentes = []
-            pesos = []
-
-            if limite_sugerido_base_media12m is not None:
-                componentes.append(limite_sugerido_base_media12m)
-                pesos.append(0.50)
-            if limite_sugerido_base_media3m is not None:
-                componentes.append(limite_sugerido_base_media3m)
-                pesos.append(0.30)
-            if limite_sugerido_base_ultimo_mes is not None:
-                componentes.append(limite_sugerido_base_ultimo_mes)
-                pesos.append(0.20)
-
-            if componentes and sum(pesos) > 0:
-                limite_sugerido_base_mensal_mix = sum(
-                    c * p for c, p in zip(componentes, pesos)
-                ) / sum(pesos)
-            else:
-                limite_sugerido_base_mensal_mix = None
-
-            # 10.5 Share da clínica na carteira (12M)
-            dt_inicio_12m_share = last_dt_clin - pd.DateOffset(months=11)
-            df_port_12m = df[df["mes_ref_date"] >= dt_inicio_12m_share].copy()
-            if not df_port_12m.empty and total_emit_12m_clin is not None:
-                total_emit_portfolio_12m = _safe_float(
-                    df_port_12m["valor_total_emitido"].sum()
-                )
-                if total_emit_portfolio_12m and total_emit_portfolio_12m > 0:
-                    limite_sugerido_share_portfolio_12m = _safe_float(
-                        total_emit_12m_clin / total_emit_portfolio_12m
-                    )
-
-            # 🔥 Usa o score do último mês da CLÍNICA, não do período filtrado
-            score_para_limite = _safe_float(df_ultimo_mes_clin["score_ajustado"].mean())
-            limite_sugerido_fator = _fator_limite_score(score_para_limite)
-
-            base_para_limite = limite_sugerido_base_mensal_mix or 0.0
-            bruto = base_para_limite * (limite_sugerido_fator or 0.0)
-
-            if bruto and bruto > 0:
-                # Nova trava de segurança: 150% do MAIOR faturamento base (1M, 3M, 12M)
-                bases_validas = [
-                    b for b in [
-                        limite_sugerido_base_media12m,
-                        limite_sugerido_base_media3m,
-                        limite_sugerido_base_ultimo_mes
-                    ] if b is not None and b > 0
-                ]
-                maior_base = max(bases_validas) if bases_validas else 0
-                teto_dinamico = 1.5 * maior_base
-
-                limite_sugerido = min(bruto, teto_dinamico, LIMITE_TETO_GLOBAL)
-
-            else:
-                limite_sugerido = None
+    # Mesma regra do ranking (tabela por clínica da política de crédito)
+    if clinica_id and clinica_id in limites.index:
+        lim = limites.loc[clinica_id]
+        limite_sugerido = _safe_float(lim["limite_sugerido"])
+        limite_sugerido_base_media12m = _safe_float(lim["base_media12m"])
+        limite_sugerido_base_media3m = _safe_float(lim["base_media3m"])
+        limite_sugerido_base_ultimo_mes = _safe_float(lim["base_ultimo_mes"])
+        limite_sugerido_base_mensal_mix = _safe_float(lim["base_mensal_mix"])
+        limite_sugerido_fator = _safe_float(lim["fator"])
+        limite_sugerido_share_portfolio_12m = _safe_float(lim["share_portfolio_12m"])
 
     # --------------------------
     # 11) Séries temporais
@@ -1317,48 +1098,11 @@ async def dashboard_completo(
             agg_periodo_por_clinica, on="clinica_id", how="left"
         )
 
+        limite_por_clinica = limites["limite_sugerido"].to_dict()
+
         for _, row in df_rank.iterrows():
             current_clinica_id = _safe_str(row.get("clinica_id"))
-            
-            # --- Cálculo do Limite Sugerido para esta clínica ---
-            limite_sugerido_para_clinica = None
-            df_clin_all = df[df["clinica_id"] == current_clinica_id].copy()
-            if not df_clin_all.empty:
-                last_dt_clin = df_clin_all["mes_ref_date"].max()
-
-                # Bases de faturamento (12M, 3M, 1M)
-                dt_inicio_12m_clin = last_dt_clin - pd.DateOffset(months=11)
-                df_clin_12m = df_clin_all[df_clin_all["mes_ref_date"] >= dt_inicio_12m_clin].copy()
-                total_emit_12m_clin = _safe_float(df_clin_12m["valor_total_emitido"].sum())
-                n_meses_12m_clin = int(df_clin_12m["mes_ref_date"].nunique() or 0)
-                base_media12m = total_emit_12m_clin / n_meses_12m_clin if n_meses_12m_clin > 0 and total_emit_12m_clin is not None else None
-
-                dt_inicio_3m = last_dt_clin - pd.DateOffset(months=2)
-                df_last3 = df_clin_all[(df_clin_all["mes_ref_date"] >= dt_inicio_3m) & (df_clin_all["mes_ref_date"] <= last_dt_clin)].copy()
-                base_media3m = _safe_float(df_last3["valor_total_emitido"].mean()) if not df_last3.empty else None
-
-                df_ultimo_mes_clin = df_clin_all[df_clin_all["mes_ref_date"] == last_dt_clin].copy()
-                base_ultimo_mes = _safe_float(df_ultimo_mes_clin["valor_total_emitido"].sum()) if not df_ultimo_mes_clin.empty else None
-
-                componentes = []
-                pesos = []
-                if base_media12m is not None: componentes.append(base_media12m); pesos.append(0.50)
-                if base_media3m is not None: componentes.append(base_media3m); pesos.append(0.30)
-                if base_ultimo_mes is not None: componentes.append(base_ultimo_mes); pesos.append(0.20)
-                base_mensal_mix = sum(c * p for c, p in zip(componentes, pesos)) / sum(pesos) if componentes and sum(pesos) > 0 else None
-
-                score_para_limite = _safe_float(df_ultimo_mes_clin["score_ajustado"].mean())
-                fator = _fator_limite_score(score_para_limite)
-
-                base_para_limite = base_mensal_mix or 0.0
-                bruto = base_para_limite * (fator or 0.0)
-
-                if bruto and bruto > 0:
-                    bases_validas = [b for b in [base_media12m, base_media3m, base_ultimo_mes] if b is not None and b > 0]
-                    maior_base = max(bases_validas) if bases_validas else 0
-                    teto_dinamico = 1.5 * maior_base
-                    limite_sugerido_para_clinica = min(bruto, teto_dinamico, LIMITE_TETO_GLOBAL)
-            # --- Fim do cálculo ---
+            limite_sugerido_para_clinica = _safe_float(limite_por_clinica.get(current_clinica_id))
 
             ranking.append({
                 "clinica_id": current_clinica_id,
@@ -1449,153 +1193,57 @@ async def dashboard_completo(
 
 @app.post("/export-dashboard", response_class=StreamingResponse)
 async def export_dashboard(dashboard_data: DashboardData):
-    # Funções auxiliares aninhadas para evitar poluir o escopo global
-    # e garantir que a lógica seja autocontida para a exportação.
-    def _clamp01(x):
-        try:
-            x = float(x)
-        except Exception:
-            return 0.0
-        if pd.isna(x):
-            return 0.0
-        return max(0.0, min(1.0, x))
-
-    def _calc_score_row(row):
-        inad_real = row.get("taxa_inadimplencia_real")
-        pago_venc = row.get("taxa_pago_no_vencimento")
-        dias = row.get("tempo_medio_pagamento_dias")
-        parc = row.get("parc_media_parcelas_pond")
-
-        risk_inad = _clamp01(inad_real / 0.03) if inad_real is not None else 0.0
-        risk_atraso = _clamp01((1.0 - float(pago_venc)) / 0.25) if pago_venc is not None else 0.0
-        risk_dias = _clamp01((float(dias) - 5.0) / 60.0) if dias is not None else 0.0
-        risk_parc = _clamp01((float(parc) - 1.0) / 11.0) if parc is not None else 0.0
-
-        score = 1.0 - (0.50 * risk_inad + 0.25 * risk_atraso + 0.15 * risk_dias + 0.10 * risk_parc)
-        return max(0.0, min(1.0, score))
-
-    def _fator_limite_score(s):
-        s = _safe_float(s)
-        if s is None: return 0.10
-        if s >= 0.80: return 0.40
-        if s >= 0.70: return 0.30
-        if s >= 0.60: return 0.25
-        if s >= 0.50: return 0.20
-        if s >= 0.40: return 0.15
-        if s >= 0.20: return 0.10
-        return 0.05
-
     # 1. Obter filtros do payload
     filtros = dashboard_data.filtros.get("periodo", {})
     inicio = filtros.min_mes_ref
     fim = filtros.max_mes_ref
 
-    # 2. Carregar todos os dados da view
+    # 2. Política de crédito sobre o snapshot da view (a mesma do /dashboard)
     try:
-        rows = supabase_get("vw_dashboard_final", select="*")
+        view = await get_snapshot().obter()
+        df_full, limites = await _carteira()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao carregar dados para exportação: {e}")
 
-    df_full = to_df(rows)
-    if df_full.empty:
+    if view.empty:
         raise HTTPException(status_code=404, detail="Nenhum dado encontrado para exportar.")
 
-    # 3. Pré-processamento (copiado e adaptado de /dashboard)
-    df_full["mes_ref_date"] = pd.to_datetime(df_full.get("mes_ref_date", df_full.get("mes_ref")), errors="coerce")
-    df_full.dropna(subset=["mes_ref_date"], inplace=True)
-
-    hoje_utc = datetime.utcnow()
-    primeiro_dia_mes_atual = hoje_utc.replace(day=1, hour=0, minute=0, second=0, microsecond=0).date()
-    df_full = df_full[df_full["mes_ref_date"].dt.date < primeiro_dia_mes_atual]
-
-    for col in ["valor_total_emitido", "taxa_pago_no_vencimento", "taxa_inadimplencia", "tempo_medio_pagamento_dias", "parc_media_parcelas_pond", "limite_aprovado"]:
-        if col in df_full.columns:
-            df_full[col] = pd.to_numeric(df_full[col], errors="coerce")
-    
-    df_full["valor_total_emitido"] = df_full["valor_total_emitido"].fillna(0)
+    # 3. KPIs do período, todas as clínicas de uma vez
+    dt_inicio = pd.to_datetime(inicio + "-01") if inicio else None
+    dt_fim = (pd.to_datetime(fim + "-01") + pd.offsets.MonthEnd(0)) if fim else None
 
-    # Inadimplência Real
-    df_full["taxa_pago_no_vencimento"] = df_full["taxa_pago_no_vencimento"].fillna(0).clip(0, 1)
-    df_full["taxa_inad_dos_atrasados"] = df_full["taxa_inadimplencia"].fillna(0).clip(0, 1)
-    df_full["valor_nao_pago_no_venc"] = df_full["valor_total_emitido"] * (1 - df_full["taxa_pago_no_vencimento"])
-    df_full["valor_inad_real"] = df_full["valor_nao_pago_no_venc"] * df_full["taxa_inad_dos_atrasados"]
-    
-    mask_emitido = df_full["valor_total_emitido"] > 0
-    df_full["taxa_inadimplencia_real"] = None
-    df_full.loc[mask_emitido, "taxa_inadimplencia_real"] = df_full.loc[mask_emitido, "valor_inad_real"] / df_full.loc[mask_emitido, "valor_total_emitido"]
+    df_recorte = df_full
+    if dt_inicio and dt_fim:
+        df_recorte = df_full[
+            (df_full["mes_ref_date"] >= dt_inicio) &
+            (df_full["mes_ref_date"] <= dt_fim)
+        ]
 
-    # Score Ajustado
-    df_full["score_ajustado"] = df_full.apply(_calc_score_row, axis=1)
+    totais = df_recorte.groupby("clinica_id")[["valor_total_emitido", "valor_inad_real"]].sum()
+    emitido_por_clinica = totais["valor_total_emitido"].to_dict()
+    inad_por_clinica = totais["valor_inad_real"].to_dict()
+    limite_por_clinica = limites["limite_sugerido"].to_dict()
 
-    # 4. Preparar dados para exportação
+    # 4. Uma linha por clínica do ranking recebido
     export_rows = []
-    
-    dt_inicio = pd.to_datetime(inicio + "-01") if inicio else None
-    dt_fim = (pd.to_datetime(fim + "-01") + pd.offsets.MonthEnd(0)) if fim else None
-
-    # Iterar sobre as clínicas do ranking recebido
     for clinica_rank_info in dashboard_data.ranking_clinicas:
         clinica_id = clinica_rank_info.clinica_id
-        df_clinica_full = df_full[df_full["clinica_id"] == clinica_id].copy()
-
-        if df_clinica_full.empty:
+        if clinica_id not in limites.index:
             continue
-        
-        # Filtrar pelo período para KPIs
-        df_recorte = df_clinica_full
-        if dt_inicio and dt_fim:
-            df_recorte = df_clinica_full[
-                (df_clinica_full["mes_ref_date"] >= dt_inicio) &
-                (df_clinica_full["mes_ref_date"] <= dt_fim)
-            ].copy()
-        
-        # Calcular KPIs do período
-        valor_emitido_periodo = _safe_float(df_recorte["valor_total_emitido"].sum())
-        
+
+        valor_emitido_periodo = _safe_float(emitido_por_clinica.get(clinica_id, 0.0))
+
         inadimplencia_periodo = None
-        total_emitido_recorte = _safe_float(df_recorte["valor_total_emitido"].sum())
-        total_inad_recorte = _safe_float(df_recorte["valor_inad_real"].sum())
-        if total_emitido_recorte and total_emitido_recorte > 0 and total_inad_recorte is not None:
-            inadimplencia_periodo = total_inad_recorte / total_emitido_recorte
-            
-        # Calcular Limite Sugerido (regra normal)
-        limite_sugerido = None
-        LIMITE_TETO_GLOBAL = 1_000_000.0
-        
-        last_dt_clin = df_clinica_full["mes_ref_date"].max()
-        
-        score_atual_clinica = None
-        if not df_recorte.empty:
-            last_dt_recorte = df_recorte["mes_ref_date"].max()
-            df_ultimo_mes_recorte = df_recorte[df_recorte["mes_ref_date"] == last_dt_recorte]
-            if not df_ultimo_mes_recorte.empty:
-                score_atual_clinica = _safe_float(df_ultimo_mes_recorte["score_ajustado"].mean())
-
-        # Bases de faturamento (12M, 3M, 1M)
-        base_12m = _safe_float(df_clinica_full[df_clinica_full["mes_ref_date"] >= last_dt_clin - pd.DateOffset(months=11)]["valor_total_emitido"].mean())
-        base_3m = _safe_float(df_clinica_full[df_clinica_full["mes_ref_date"] >= last_dt_clin - pd.DateOffset(months=2)]["valor_total_emitido"].mean())
-        base_1m = _safe_float(df_clinica_full[df_clinica_full["mes_ref_date"] == last_dt_clin]["valor_total_emitido"].sum())
-        
-        componentes = []
-        pesos = []
-        if base_12m: componentes.append(base_12m); pesos.append(0.5)
-        if base_3m: componentes.append(base_3m); pesos.append(0.3)
-        if base_1m: componentes.append(base_1m); pesos.append(0.2)
-        
-        base_mensal_mix = sum(c * p for c, p in zip(componentes, pesos)) / sum(pesos) if componentes else 0.0
-        
-        fator = _fator_limite_score(score_atual_clinica)
-        bruto = base_mensal_mix * fator
-        
-        if bruto > 0:
-            limite_sugerido = min(bruto, LIMITE_TETO_GLOBAL)
+        total_inad_recorte = _safe_float(inad_por_clinica.get(clinica_id, 0.0))
+        if valor_emitido_periodo and valor_emitido_periodo > 0 and total_inad_recorte is not None:
+            inadimplencia_periodo = total_inad_recorte / valor_emitido_periodo
 
         export_rows.append({
             "Nome": clinica_rank_info.clinica_nome,
             "CNPJ": clinica_rank_info.cnpj,
             "Valor Emitido": valor_emitido_periodo,
             "Inadimplência": inadimplencia_periodo,
-            "Limite Sugerido": limite_sugerido,
+            "Limite Sugerido": _safe_float(limite_por_clinica.get(clinica_id)),
             "Limite Aprovado": clinica_rank_info.limite_aprovado,
         })
 
@@ -0,0 +1,530 @@
+"""
+Motor único de leitura das planilhas de clínicas.
+
+processor.py (upload/API), importar.py e converter.py são só front-ends
+sobre parse_excel_from_bytes; qualquer regra ou otimização de parse vai
+aqui. verificar_parse.py compara os três com o golden de Clinicas/.
+"""
+
+import math
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from io import BytesIO
+from openpyxl import load_workbook
+
+# ==========================
+# HELPERS
+# ==========================
+
+def to_str(v):
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d")
+    if pd.isna(v):
+        return None
+    return str(v).strip()
+
+
+_TYPE = np.frompyfunc(type, 1, 1)
+
+
+def _tipos(values):
+    """Tipo de cada célula (datetime para Timestamp também), elemento a elemento em C."""
+    tipos = _TYPE(values)
+    tipos[tipos == pd.Timestamp] = datetime
+    return tipos
+
+
+# ==========================
+# CONVERSORES POR COLUNA
+# ==========================
+
+def col_mes_ref(values):
+    """Converte a coluna inteira para "%Y-%m" com um único to_datetime."""
+    datas = pd.to_datetime(values, errors="coerce", format="mixed")
+    out = np.asarray(datas.strftime("%Y-%m"), dtype=object)
+
+    falhas = datas.isna()
+    if falhas.any():
+        out[falhas] = [to_str(v) for v in values[falhas]]
+
+    return out.tolist()
+
+
+def col_valor(values):
+    out = values.copy()
+    out[pd.isna(values)] = None
+    return out.tolist()
+
+
+def col_percentual(values):
+    """Percentuais como float; valores exagerados do Excel (> 1e10) são reescalados."""
+    v = pd.to_numeric(values, errors="coerce").astype(float)
+    v = np.where(v > 10_000_000_000, v / 1_000_000_000_000, v)
+
+    out = v.astype(object)
+    out[np.isnan(v)] = None
+    return out.tolist()
+
+
+def col_faixa(values):
+    """
+    Restaura as faixas que o Excel converteu em data (01/07 e 01/01 → 0-7,
+    01/08 → 8-15), venham como datetime ou já como texto "YYYY-MM-DD".
+    """
+    out = values.astype(str).astype(object)
+
+    tipos = _tipos(values)
+    datas = pd.Series(pd.NaT, index=np.arange(len(values)), dtype="datetime64[us]")
+
+    eh_data = tipos == datetime
+    if eh_data.any():
+        datas[eh_data] = pd.DatetimeIndex(values[eh_data])
+
+    eh_texto = tipos == str
+    if eh_texto.any():
+        datas[eh_texto] = pd.to_datetime(values[eh_texto], errors="coerce", format="%Y-%m-%d")
+
+    ok = datas.notna().to_numpy()
+    if ok.any():
+        dia, mes = datas[ok].dt.day.to_numpy(), datas[ok].dt.month.to_numpy()
+        out[ok] = np.select(
+            [(dia == 1) & np.isin(mes, [7, 1]), (dia == 1) & (mes == 8)],
+            ["0-7", "8-15"],
+            default=datas[ok].dt.strftime("%Y-%m-%d").to_numpy(dtype=object),
+        )
+
+    return out.tolist()
+
+
+# ==========================
+# REGISTRO DE BLOCOS
+# ==========================
+
+# A ordem importa: o primeiro título que casar define a tabela.
+# Cada coluna do bloco é (campo, índice na planilha, conversor).
+BLOCOS = [
+    (re.compile(r"boleto[s]?\s*emit"), "boletos_emitidos", [
+        ("mes_ref", 0, col_mes_ref),
+        ("qtde", 1, col_valor),
+        ("valor_total", 2, col_valor),
+    ]),
+    (re.compile(r"pagamento no vencimento|taxa de pagamento"), "taxa_pago_no_vencimento", [
+        ("mes_ref", 0, col_mes_ref),
+        ("taxa", 1, col_percentual),
+    ]),
+    (re.compile(r"taxa de atraso"), "taxa_atraso_mensal", [
+        ("mes_ref", 0, col_mes_ref),
+        ("taxa", 1, col_percentual),
+    ]),
+    (re.compile(r"taxa de atraso"), "taxa_atraso_faixa", [
+        ("mes_ref", 0, col_mes_ref),
+        ("faixa", 1, col_faixa),
+        ("qtde", 2, col_valor),
+        ("percentual", 3, col_percentual),
+    ]),
+    (re.compile(r"inadimpl"), "inadimplencia", [
+        ("mes_ref", 0, col_mes_ref),
+        ("taxa", 1, col_percentual),
+    ]),
+    (re.compile(r"tempo médio|medio"), "tempo_medio_pagamento", [
+        ("mes_ref", 0, col_mes_ref),
+        ("dias", 1, col_valor),
+    ]),
+    (re.compile(r"valor médio"), "valor_medio_boleto", [
+        ("mes_ref", 0, col_mes_ref),
+        ("valor", 1, col_valor),
+    ]),
+    (re.compile(r"parcel"), "parcelamentos_detalhe", [
+        ("mes_ref", 0, col_mes_ref),
+        ("qtde_parcelas", 1, col_valor),
+        ("qtde", 2, col_valor),
+        ("percentual", 3, col_percentual),
+    ]),
+]
+
+
+# Blocos que só valem até esta largura de header; o agregado mensal de
+# atraso tem o mesmo título da versão por faixa, só que com 2 colunas.
+LARGURA_MAXIMA = {"taxa_atraso_mensal": 2}
+
+
+def _largura(header):
+    return sum(1 for v in header or [] if not pd.isna(v))
+
+
+def identificar_bloco(title, header=None):
+    tl = title.lower().strip()
+    for padrao, tabela, colunas in BLOCOS:
+        if tabela in LARGURA_MAXIMA and _largura(header) > LARGURA_MAXIMA[tabela]:
+            continue
+        if padrao.search(tl):
+            return tabela, colunas
+    return None, None
+
+
+# ==========================
+# PARSE BLOCO
+# ==========================
+
+def parse_block(title, header, rows):
+    tabela, colunas = identificar_bloco(title, header)
+
+    if not tabela or not rows:
+        return (tabela, [])
+
+    grid = np.empty((len(rows), len(rows[0])), dtype=object)
+    grid[:] = rows
+
+    campos = [campo for campo, _, _ in colunas]
+    valores = [
+        conv(grid[:, idx]) if idx < grid.shape[1] else [None] * len(rows)
+        for _, idx, conv in colunas
+    ]
+
+    return (tabela, [dict(zip(campos, linha)) for linha in zip(*valores)])
+
+
+# ==========================
+# LEITURA DA PLANILHA
+# ==========================
+
+# Mesmos marcadores de vazio que o pandas usa por padrão no read_excel
+NA_STRINGS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null",
+}
+
+
+def _celula(v):
+    """Normaliza a célula como o read_excel faria (vazio → NaN, 5.0 → 5)."""
+    if v is None:
+        return math.nan
+    if isinstance(v, float):
+        return int(v) if v.is_integer() else v
+    if isinstance(v, str) and v in NA_STRINGS:
+        return math.nan
+    return v
+
+
+def _abrir(contents):
+    """Bytes em memória ou caminho do arquivo (o zip é lido direto do disco)."""
+    if isinstance(contents, (bytes, bytearray, memoryview)):
+        return BytesIO(contents)
+    return contents
+
+
+def _normalizar(valores):
+    """Linhas normalizadas e com a mesma largura (sem linhas vazias no final)."""
+    linhas = []
+    largura = 0
+    ultima_preenchida = -1
+
+    for values in valores:
+        row = [_celula(v) for v in values]
+        while row and isinstance(row[-1], float) and math.isnan(row[-1]):
+            row.pop()
+        if row:
+            largura = max(largura, len(row))
+            ultima_preenchida = len(linhas)
+        linhas.append(row)
+
+    del linhas[ultima_preenchida + 1:]
+    for row in linhas:
+        row.extend([math.nan] * (largura - len(row)))
+
+    return linhas
+
+
+# ==========================
+# LEITORES (BACKENDS DE XLSX)
+# ==========================
+
+# Qual leitor decodifica o .xlsx; compare com benchmark_leitores.py
+PLANILHA_LEITOR = os.getenv("PLANILHA_LEITOR", "openpyxl")
+
+
+class LeitorOpenpyxl:
+    """openpyxl em modo read-only/values-only: as linhas saem do XML aos poucos."""
+
+    def __init__(self, contents):
+        self.wb = load_workbook(_abrir(contents), read_only=True, data_only=True)
+
+    def abas(self):
+        return self.wb.sheetnames
+
+    def linhas(self, indice):
+        return self.wb.worksheets[indice].iter_rows(values_only=True)
+
+    def fechar(self):
+        self.wb.close()
+
+
+class LeitorPandas:
+    """pd.ExcelFile + read_excel (openpyxl), o caminho dos parsers antigos."""
+
+    def __init__(self, contents):
+        self.xls = pd.ExcelFile(_abrir(contents), engine="openpyxl")
+
+    def abas(self):
+        return self.xls.sheet_names
+
+    def linhas(self, indice):
+        df = pd.read_excel(self.xls, sheet_name=indice, header=None)
+        return df.itertuples(index=False, name=None)
+
+    def fechar(self):
+        self.xls.close()
+
+
+def _data_hora(v):
+    # calamine devolve date para células só com data; o resto do parse espera datetime
+    if type(v) is date:
+        return datetime(v.year, v.month, v.day)
+    return v
+
+
+class LeitorCalamine:
+    """python-calamine (Rust), opcional: decodifica cada aba inteira de uma vez."""
+
+    def __init__(self, contents):
+        try:
+            from python_calamine import CalamineWorkbook
+        except ImportError:
+            raise RuntimeError("Instale o python-calamine para usar PLANILHA_LEITOR=calamine.")
+
+        if isinstance(contents, (bytes, bytearray, memoryview)):
+            self.wb = CalamineWorkbook.from_filelike(BytesIO(contents))
+        else:
+            self.wb = CalamineWorkbook.from_path(contents)
+
+    def abas(self):
+        return self.wb.sheet_names
+
+    def linhas(self, indice):
+        aba = self.wb.get_sheet_by_index(indice)
+        for row in aba.to_python(skip_empty_area=False):
+            yield [_data_hora(v) for v in row]
+
+    def fechar(self):
+        fechar = getattr(self.wb, "close", None)  # só nas versões mais novas
+        if fechar:
+            fechar()
+
+
+LEITORES = {
+    "openpyxl": LeitorOpenpyxl,
+    "pandas": LeitorPandas,
+    "calamine": LeitorCalamine,
+}
+
+
+def abrir_leitor(contents, leitor=None):
+    nome = leitor or PLANILHA_LEITOR
+    if nome not in LEITORES:
+        raise ValueError(f"Leitor de planilha desconhecido: {nome} (opções: {', '.join(LEITORES)})")
+    return LEITORES[nome](contents)
+
+
+def ler_abas(contents: bytes | str, leitor=None):
+    """
+    Lê a pasta de trabalho uma única vez, com o leitor configurado.
+
+    Para cada aba devolve (nome, linhas), onde `linhas` é uma lista de listas
+    já normalizadas e com a mesma largura (sem linhas vazias no final),
+    sem montar nenhum DataFrame.
+    """
+    lt = abrir_leitor(contents, leitor)
+    try:
+        for i, nome in enumerate(lt.abas()):
+            yield nome, _normalizar(lt.linhas(i))
+    finally:
+        lt.fechar()
+
+
+# ==========================
+# ABAS EM PARALELO
+# ==========================
+
+# Processos para decodificar as abas de uma mesma pasta (0 ou 1 = sequencial).
+# Só compensa em pastas com várias abas grandes (um bloco por aba).
+PARSE_ABAS_WORKERS = int(os.getenv("PARSE_ABAS_WORKERS", "0"))
+
+_pool_abas = None
+_pool_abas_workers = 0  # max_workers com que _pool_abas foi criado
+_pool_abas_lock = threading.Lock()
+
+
+def _get_pool_abas(workers):
+    global _pool_abas, _pool_abas_workers
+
+    with _pool_abas_lock:
+        if _pool_abas is None or _pool_abas_workers != workers:
+            if _pool_abas is not None:
+                _pool_abas.shutdown(wait=False)
+            _pool_abas = ProcessPoolExecutor(max_workers=workers)
+            _pool_abas_workers = workers
+        return _pool_abas
+
+
+def _ler_aba(contents, indice, leitor):
+    """Roda no worker: abre a pasta e decodifica só a aba `indice`."""
+    lt = abrir_leitor(contents, leitor)
+    try:
+        return lt.abas()[indice], _normalizar(lt.linhas(indice))
+    finally:
+        lt.fechar()
+
+
+def ler_abas_paralelo(contents: bytes | str, workers, leitor=None):
+    """
+    Mesmo resultado de ler_abas (lista, na ordem das abas), com as abas 2..n
+    decodificadas em processos separados enquanto este lê a primeira.
+    Cada worker recebe `contents`: prefira o caminho do arquivo aos bytes.
+    """
+    leitor = leitor or PLANILHA_LEITOR
+    lt = abrir_leitor(contents, leitor)
+    try:
+        nomes = lt.abas()
+        if len(nomes) < 2:
+            return [(nome, _normalizar(lt.linhas(i))) for i, nome in enumerate(nomes)]
+
+        pool = _get_pool_abas(workers)
+        futuros = [pool.submit(_ler_aba, contents, i, leitor) for i in range(1, len(nomes))]
+
+        abas = [(nomes[0], _normalizar(lt.linhas(0)))]
+    finally:
+        lt.fechar()
+
+    return abas + [f.result() for f in futuros]
+
+
+def _buscar_cnpj(linhas):
+    for i in range(min(10, len(linhas) - 1)):
+        if linhas[i] and str(linhas[i][0]).strip() == "CNPJ":
+            prox = linhas[i + 1]
+            return to_str(prox[0]), to_str(prox[1]) if len(prox) > 1 else None
+    return None, None
+
+
+def _contem(grid, trecho):
+    """Máscara das células de texto que contêm `trecho`."""
+    eh_str = _tipos(grid) == str
+    mask = np.zeros(grid.shape, dtype=bool)
+    mask[eh_str] = np.char.find(grid[eh_str].astype(str), trecho) >= 0
+    return mask
+
+
+def _mascaras(linhas):
+    """
+    Máscaras da aba inteira, calculadas de uma vez: linha vazia e linha que
+    abre um bloco (título na coluna 0 e header com MesRef logo abaixo, ou
+    bloco sem header mas com datas na linha seguinte).
+    """
+    nrows = len(linhas)
+    grid = np.empty((nrows, len(linhas[0])), dtype=object)
+    grid[:] = linhas
+
+    vazia = pd.isna(grid).all(axis=1)
+
+    col0 = grid[:, 0]
+    inicia = _tipos(col0) == str
+    inicia[inicia] = ~np.isin(
+        np.char.strip(col0[inicia].astype(str)), ["", "CNPJ"]
+    )
+    inicia[-1] = False
+
+    # header na linha i + 1 ou, na falta dele, data na coluna 0 da linha i + 2
+    header_ok = np.zeros(nrows, dtype=bool)
+    header_ok[:-1] = _contem(grid[1:], "MesRef").any(axis=1)
+    datas_abaixo = np.zeros(nrows, dtype=bool)
+    datas_abaixo[:-2] = _tipos(col0[2:]) == datetime
+    inicia &= header_ok | datas_abaixo
+
+    return vazia, inicia
+
+
+def _fim(idx_vazias, i, nrows):
+    """Fim (exclusivo) do bloco com título em i: primeira linha vazia depois do header."""
+    pos = np.searchsorted(idx_vazias, i + 2)
+    return int(idx_vazias[pos]) if pos < len(idx_vazias) else nrows
+
+
+def _segmentar_blocos(linhas):
+    """
+    Localiza os blocos dentro de uma aba: devolve (i, fim), com o título na
+    linha i, o header em i + 1 e os dados em i + 2 até fim (exclusivo).
+
+    As máscaras de linha vazia e de início de bloco são calculadas de uma
+    vez sobre a aba inteira; o laço só percorre os inícios de bloco.
+    """
+    nrows = len(linhas)
+    if nrows < 2:
+        return
+
+    vazia, inicia = _mascaras(linhas)
+    idx_vazias = np.flatnonzero(vazia)
+    cursor = 0
+
+    for i in np.flatnonzero(inicia):
+        if i < cursor:
+            continue
+
+        fim = _fim(idx_vazias, i, nrows)
+        yield int(i), fim
+
+        cursor = fim
+
+
+# ==========================
+# PARSE EXCEL
+# ==========================
+
+def parse_excel_from_bytes(contents: bytes | str, workers=None, leitor=None):
+    """
+    Parse completo da pasta. `workers` (padrão PARSE_ABAS_WORKERS) > 1 decodifica
+    as abas em paralelo; o resultado é o mesmo e na mesma ordem do sequencial.
+    `leitor` escolhe o backend de leitura (padrão PLANILHA_LEITOR).
+    """
+    workers = PARSE_ABAS_WORKERS if workers is None else workers
+    cnpj = None
+    external_id = None
+
+    result = {
+        "estabelecimento": {"cnpj": None, "external_id": None},
+        "boletos_emitidos": [],
+        "taxa_pago_no_vencimento": [],
+        "taxa_atraso_mensal": [],
+        "taxa_atraso_faixa": [],
+        "inadimplencia": [],
+        "tempo_medio_pagamento": [],
+        "valor_medio_boleto": [],
+        "parcelamentos_detalhe": []
+    }
+
+    # Uma leitura da pasta: CNPJ e blocos saem das mesmas linhas
+    if workers > 1:
+        abas = ler_abas_paralelo(contents, workers, leitor)
+    else:
+        abas = list(ler_abas(contents, leitor))
+
+    for _, linhas in abas:
+        if not cnpj:
+            cnpj, external_id = _buscar_cnpj(linhas)
+
+        for i, fim in _segmentar_blocos(linhas):
+            tipo, dados = parse_block(linhas[i][0], linhas[i + 1], linhas[i + 2:fim])
+            if tipo:
+                result[tipo].extend(dados)
+
+    if not cnpj:
+        raise RuntimeError("Não foi possível localizar CNPJ no arquivo.")
+
+    result["estabelecimento"] = {"cnpj": cnpj, "external_id": external_id}
+
+    return result
@@ -1,85 +1,20 @@
 import os
-import re
+import json
+import hashlib
 import math
-import requests
+import time
 import pandas as pd
-from datetime import datetime
-from dotenv import load_dotenv
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from cache_parse import get_cache
+from clinicas import get_or_create_clinica
+from planilha import parse_excel_from_bytes
+from supabase_client import get_client
 
 # ==========================
-# CARREGAR ENV
+# SUPABASE CLIENT
 # ==========================
 
-load_dotenv()
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-
-if not SUPABASE_URL:
-    raise RuntimeError("⚠️ Defina SUPABASE_URL no .env")
-
-if "db." in SUPABASE_URL:
-    SUPABASE_URL = SUPABASE_URL.replace("db.", "")
-
-if not SERVICE_ROLE_KEY:
-    raise RuntimeError("⚠️ Defina SERVICE_ROLE_KEY no .env")
-
-HEADERS = {
-    "apikey": SERVICE_ROLE_KEY,
-    "Authorization": f"Bearer {SERVICE_ROLE_KEY}",
-    "Content-Type": "application/json",
-    "Prefer": "resolution=merge-duplicates"
-}
-
-
-# ==========================
-# HELPERS
-# ==========================
-
-def to_str(v):
-    if isinstance(v, datetime):
-        return v.strftime("%Y-%m-%d")
-    if pd.isna(v):
-        return None
-    return str(v).strip()
-
-
-def fix_percentual(v):
-    if pd.isna(v):
-        return None
-    if isinstance(v, str):
-        try:
-            v = float(v)
-        except:
-            return None
-    if v > 10_000_000_000:
-        return v / 1_000_000_000_000
-    return v
-
-
-def fix_faixa(v):
-    if isinstance(v, datetime):
-        d, m = v.day, v.month
-        if (d, m) in [(1, 7), (1, 1)]:
-            return "0-7"
-        if (d, m) == (1, 8):
-            return "8-15"
-        return str(v.date())
-    return str(v)
-
-
-def normalize_mesref(v):
-    try:
-        return pd.to_datetime(v).strftime("%Y-%m")
-    except:
-        return to_str(v)
-
-
-def json_safe(o):
-    if isinstance(o, float) and math.isnan(o):
-        return None
-    return o
+supabase = get_client()
 
 
 # ==========================
@@ -95,7 +30,17 @@ def normalize_for_conflict(item, cols):
             item[key] = None
 
 
-def dedupe(registros, conflict_cols):
+def dedupe(registros, conflict_cols, manter_ultimo=False):
+    """
+    Uma linha por chave de conflito. Por padrão fica a primeira; com
+    manter_ultimo fica a última, como em upserts feitos um após o outro.
+    """
+    if manter_ultimo:
+        por_chave = {}
+        for row in registros:
+            por_chave[tuple(row.get(c) for c in conflict_cols)] = row
+        return list(por_chave.values())
+
     seen = set()
     out = []
     for row in registros:
@@ -110,13 +55,55 @@ def dedupe(registros, conflict_cols):
 # SUPABASE
 # ==========================
 
-def supabase_upsert(table, data, conflict):
-    url = f"{SUPABASE_URL}/rest/v1/{table}?on_conflict={conflict}"
-    r = requests.post(url, headers=HEADERS, json=data)
+# Recusas que podem ser causadas pelas linhas do lote (dados inválidos,
+# conflito, lote grande demais). 401/403/404 e afins são de credencial/tabela
+# e derrubam a importação na hora.
+STATUS_ERRO_DE_LINHA = (400, 409, 413, 422)
+
+# Classes de SQLSTATE que apontam para uma linha: 22 (dado inválido) e
+# 23 (restrição de integridade). PGRSTxxx e 42xxx (coluna inexistente,
+# on_conflict sem UNIQUE...) são do comando e falham em qualquer lote.
+SQLSTATE_DE_LINHA = ("22", "23")
+
+
+class UpsertError(RuntimeError):
+    """
+    Upsert recusado pelo PostgREST; `status_code` é o status HTTP da resposta
+    e `codigo` o "code" do corpo (SQLSTATE ou PGRSTxxx), quando veio.
+    """
+
+    def __init__(self, mensagem, status_code, codigo=None):
+        super().__init__(mensagem)
+        self.status_code = status_code
+        self.codigo = codigo
+
+    @property
+    def erro_de_linha(self):
+        """Se a recusa vem das linhas do lote, ou seja, se dividir o lote ajuda."""
+        if self.status_code == 413:
+            return True
+        if self.status_code not in STATUS_ERRO_DE_LINHA:
+            return False
+        if self.codigo:
+            return self.codigo[:2] in SQLSTATE_DE_LINHA
+        return True
+
 
-    if r.status_code not in (200, 201):
-        raise RuntimeError(
-            f"Erro ao enviar para {table}: {r.status_code} - {r.text}"
+def supabase_upsert(table, data, conflict, returning=False):
+    prefer = "resolution=merge-duplicates"
+    prefer += ",return=representation" if returning else ",return=minimal"
+
+    r = supabase.post(table, data, on_conflict=conflict, prefer=prefer)
+
+    if r.status_code not in (200, 201, 204):
+        try:
+            codigo = r.json().get("code")
+        except:
+            codigo = None
+        raise UpsertError(
+            f"Erro ao enviar para {table}: {r.status_code} - {r.text}",
+            r.status_code,
+            codigo,
         )
 
     try:
@@ -125,251 +112,478 @@ def supabase_upsert(table, data, conflict):
         return None
 
 
-def get_or_create_clinica(cnpj, external_id):
-    url = f"{SUPABASE_URL}/rest/v1/clinicas?cnpj=eq.{cnpj}"
-    r = requests.get(url, headers=HEADERS)
+# Limites de cada requisição de upsert (o que vier primeiro)
+UPSERT_LOTE_LINHAS = int(os.getenv("UPSERT_LOTE_LINHAS", "1000"))
+UPSERT_LOTE_BYTES = int(os.getenv("UPSERT_LOTE_BYTES", str(1024 * 1024)))
 
-    if r.status_code == 200:
-        data = r.json()
-        if len(data) > 0:
-            return data[0]["id"]
 
-    payload = {
-        "cnpj": cnpj,
-        "external_id": external_id,
-        "nome": external_id or cnpj
-    }
+def _lotes(registros, max_linhas, max_bytes):
+    """Divide os registros em lotes de até `max_linhas` linhas e ~`max_bytes` de JSON."""
+    lote, tamanho = [], 0
+
+    for row in registros:
+        n = len(json.dumps(row, default=str)) + 1
+        if lote and (len(lote) >= max_linhas or tamanho + n > max_bytes):
+            yield lote
+            lote, tamanho = [], 0
+        lote.append(row)
+        tamanho += n
+
+    if lote:
+        yield lote
+
 
-    resp = supabase_upsert("clinicas", payload, "cnpj")
-    if resp:
-        return resp[0]["id"]
+def _tentar_lote(table, lote, conflict):
+    """Envia o lote; devolve None se passou ou o UpsertError se a recusa é das linhas."""
+    try:
+        supabase_upsert(table, lote, conflict)
+    except UpsertError as e:
+        if not e.erro_de_linha:
+            raise
+        return e
+    return None
+
+
+def _mesma_recusa(erro_a, erro_b):
+    """As duas metades recusadas pelo mesmo erro sem SQLSTATE: não é linha, é o comando."""
+    if not (erro_a and erro_b) or erro_a.codigo or erro_a.status_code == 413:
+        return False
+    return str(erro_a) == str(erro_b)
+
+
+def upsert_em_lotes(table, registros, conflict, max_linhas=None, max_bytes=None):
+    """
+    Upsert em lotes limitados por linhas e bytes. Um lote recusado por erro
+    de dados (UpsertError.erro_de_linha) é dividido ao meio até isolar as
+    linhas problemáticas, que são devolvidas em vez de derrubar a tabela
+    inteira. Erros do comando (schema, on_conflict, autenticação, permissão,
+    servidor, conexão) continuam levantando exceção; sem "code" no corpo, as
+    duas metades recusadas com o mesmo erro também levantam (exceto 413),
+    porque o problema não está em linha nenhuma.
+
+    Retorna (rejeitadas, divisoes): rejeitadas é uma lista de
+    {"linha", "erro"} e divisoes quantos lotes precisaram ser divididos.
+    """
+    max_linhas = max_linhas or UPSERT_LOTE_LINHAS
+    max_bytes = max_bytes or UPSERT_LOTE_BYTES
+
+    rejeitadas = []
+    divisoes = 0
+    # (lote, erro): erro é a recusa já recebida pelo lote, None se ainda não foi enviado
+    pendentes = [(lote, None) for lote in _lotes(registros, max_linhas, max_bytes)]
+    pendentes.reverse()
+
+    while pendentes:
+        lote, erro = pendentes.pop()
+        if erro is None:
+            erro = _tentar_lote(table, lote, conflict)
+            if erro is None:
+                continue
+        if len(lote) == 1:
+            rejeitadas.append({"linha": lote[0], "erro": str(erro)})
+            continue
+
+        divisoes += 1
+        meio = len(lote) // 2
+        metades = [(m, _tentar_lote(table, m, conflict)) for m in (lote[:meio], lote[meio:])]
+        (_, erro_a), (_, erro_b) = metades
+        if _mesma_recusa(erro_a, erro_b):
+            raise erro_a
+        pendentes.extend((m, e) for m, e in reversed(metades) if e)
 
-    raise RuntimeError("Não foi possível criar clínica.")
+    return rejeitadas, divisoes
 
 
 # ==========================
-# PARSE BLOCO
+# TABELAS & CHAVES
 # ==========================
 
-def parse_block(title, header, rows):
-    tl = title.lower().strip()
+TABELAS_CONFLITO = {
+    "boletos_emitidos": "clinica_id,mes_ref",
+    "taxa_pago_no_vencimento": "clinica_id,mes_ref",
+    "taxa_atraso_faixa": "clinica_id,mes_ref,faixa",
+    "inadimplencia": "clinica_id,mes_ref",
+    "tempo_medio_pagamento": "clinica_id,mes_ref",
+    "valor_medio_boleto": "clinica_id,mes_ref",
+    "parcelamentos_detalhe": "clinica_id,mes_ref,qtde_parcelas",
+}
 
-    if re.search(r"boleto[s]?\s*emit", tl):
-        return ("boletos_emitidos", [
-            {
-                "mes_ref": normalize_mesref(r[0]),
-                "qtde": json_safe(r[1]),
-                "valor_total": json_safe(r[2]) if len(r) > 2 else None
-            }
-            for r in rows
-        ])
-
-    if "pagamento no vencimento" in tl or "taxa de pagamento" in tl:
-        return ("taxa_pago_no_vencimento", [
-            {"mes_ref": normalize_mesref(r[0]), "taxa": fix_percentual(r[1])}
-            for r in rows
-        ])
-
-    if "taxa de atraso" in tl:
-        return ("taxa_atraso_faixa", [
-            {
-                "mes_ref": normalize_mesref(r[0]),
-                "faixa": fix_faixa(r[1]),
-                "qtde": json_safe(r[2]),
-                "percentual": fix_percentual(r[3])
-            }
-            for r in rows
-        ])
-
-    if "inadimpl" in tl:
-        return ("inadimplencia", [
-            {"mes_ref": normalize_mesref(r[0]), "taxa": fix_percentual(r[1])}
-            for r in rows
-        ])
-
-    if "tempo médio" in tl or "medio" in tl:
-        return ("tempo_medio_pagamento", [
-            {"mes_ref": normalize_mesref(r[0]), "dias": json_safe(r[1])}
-            for r in rows
-        ])
-
-    if "valor médio" in tl:
-        return ("valor_medio_boleto", [
-            {"mes_ref": normalize_mesref(r[0]), "valor": json_safe(r[1])}
-            for r in rows
-        ])
-
-    if "parcel" in tl:
-        return ("parcelamentos_detalhe", [
-            {
-                "mes_ref": normalize_mesref(r[0]),
-                "qtde_parcelas": json_safe(r[1]),
-                "qtde": json_safe(r[2]),
-                "percentual": fix_percentual(r[3])
-            }
-            for r in rows
-        ])
 
-    return (None, [])
+def registros_da_tabela(parsed, tabela):
+    """
+    Linhas do parse que vão para `tabela` de TABELAS_CONFLITO. O agregado
+    mensal de atraso (parsed["taxa_atraso_mensal"]) não tem tabela no banco
+    e não é enviado: em taxa_atraso_faixa ele entraria na vw_pagamentos como
+    mais uma faixa.
+    """
+    return parsed[tabela]
 
 
 # ==========================
-# PARSE EXCEL
+# REGISTRAR IMPORTAÇÃO
 # ==========================
 
-def parse_excel_from_bytes(contents: bytes):
-    xls = pd.ExcelFile(BytesIO(contents))
-
-    cnpj = None
-    external_id = None
-
-    for sheet in xls.sheet_names:
-        df = xls.parse(sheet, header=None)
-        for i in range(min(10, len(df))):
-            if str(df.iloc[i, 0]).strip() == "CNPJ":
-                cnpj = to_str(df.iloc[i + 1, 0])
-                external_id = to_str(df.iloc[i + 1, 1])
-                break
-        if cnpj:
-            break
-
-    if not cnpj:
-        raise RuntimeError("Não foi possível localizar CNPJ no arquivo.")
-
-    result = {
-        "estabelecimento": {"cnpj": cnpj, "external_id": external_id},
-        "boletos_emitidos": [],
-        "taxa_pago_no_vencimento": [],
-        "taxa_atraso_faixa": [],
-        "inadimplencia": [],
-        "tempo_medio_pagamento": [],
-        "valor_medio_boleto": [],
-        "parcelamentos_detalhe": []
+# Quantas linhas rejeitadas guardar no log de cada importação
+IMPORT_LOG_REJEITADAS = int(os.getenv("IMPORT_LOG_REJEITADAS", "100"))
+
+
+def payload_importacao(clinica_id, arquivo_nome, contagem, rejeitadas=(), sha256=None, diff=None):
+    """
+    Linha da tabela `importacoes`: `erros` = linhas rejeitadas, `avisos` =
+    tabelas importadas só em parte. As linhas rejeitadas, o SHA-256 do
+    arquivo e o diff da importação incremental vão para `log`.
+    """
+    parciais = {r["tabela"] for r in rejeitadas}
+
+    log = {"tabelas": contagem}
+    if sha256:
+        log["sha256"] = sha256
+    if diff:
+        log["incremental"] = diff
+    if rejeitadas:
+        log["rejeitadas"] = list(rejeitadas[:IMPORT_LOG_REJEITADAS])
+
+    return {
+        "clinica_id": clinica_id,
+        "arquivo_nome": arquivo_nome,
+        "total_linhas": sum(contagem.values()),
+        "erros": len(rejeitadas),
+        "avisos": len(parciais),
+        "status": "concluido_com_erros" if rejeitadas else "concluido",
+        "log": log,
     }
 
-    for sheet in xls.sheet_names:
-        df = xls.parse(sheet, header=None)
 
-        i = 0
-        nrows = len(df)
+def registrar_importacao(clinica_id, arquivo_nome, parsed, contagem, rejeitadas=(), sha256=None, diff=None):
+    payload = payload_importacao(clinica_id, arquivo_nome, contagem, rejeitadas, sha256, diff)
+    r = supabase.post("importacoes", payload, prefer="return=representation", idempotente=False)
 
-        while i < nrows - 1:
-            titulo = df.iloc[i, 0]
+    try:
+        return r.json()[0]["id"]
+    except Exception:
+        return None
 
-            if isinstance(titulo, str) and titulo.strip() not in ("", "CNPJ"):
-                header = df.iloc[i + 1]
 
-                is_header_ok = any(isinstance(c, str) and "MesRef" in c for c in header)
+def buscar_importacao_por_hash(sha256):
+    """
+    Importação concluída sem erros mais recente de um arquivo com este
+    SHA-256, ou None. Importações com linhas rejeitadas não contam: o mesmo
+    arquivo pode ser reenviado depois de corrigido o problema no banco.
+    """
+    r = supabase.get(
+        "importacoes",
+        params={
+            "select": "id,clinica_id,arquivo_nome,status,criado_em",
+            "log->>sha256": f"eq.{sha256}",
+            "status": "eq.concluido",
+            "order": "criado_em.desc",
+            "limit": "1",
+        },
+    )
+    if r.status_code != 200:
+        return None
 
-                # Detecta caso especial: bloco sem header mas com datas logo abaixo
-                is_header_missing_but_valid = (
-                    not is_header_ok
-                    and isinstance(df.iloc[i+2, 0], datetime)
-                )
+    rows = r.json()
+    return rows[0] if rows else None
 
-                if is_header_ok or is_header_missing_but_valid:
 
-                    rows = []
-                    j = i + 2
+# ==========================
+# ENVIO DAS TABELAS
+# ==========================
 
-                    while j < nrows:
-                        row = df.iloc[j]
-                        if all(pd.isna(x) for x in row):
-                            break
-                        rows.append(row.to_list())
-                        j += 1
+# Quantas tabelas são enviadas ao mesmo tempo (1 = uma depois da outra)
+IMPORT_CONCORRENCIA = int(os.getenv("IMPORT_CONCORRENCIA", "4"))
 
-                    tipo, dados = parse_block(titulo, header, rows)
-                    if tipo:
-                        result[tipo].extend(dados)
 
-                    i = j
-                    continue
+class ImportacaoError(RuntimeError):
+    """Falha no envio de uma ou mais tabelas; `resumo` traz o status de cada uma."""
 
-            i += 1
+    def __init__(self, mensagem, resumo):
+        super().__init__(mensagem)
+        self.resumo = resumo
 
-    return result
 
+def preparar_registros(registros, clinica_id, conflict):
+    conflict_cols = [c.strip() for c in conflict.split(",")]
 
-# ==========================
-# TABELAS & CHAVES
-# ==========================
+    for item in registros:
+        item["clinica_id"] = clinica_id
+        normalize_for_conflict(item, conflict_cols)
 
-TABELAS_CONFLITO = {
-    "boletos_emitidos": "clinica_id,mes_ref",
-    "taxa_pago_no_vencimento": "clinica_id,mes_ref",
-    "taxa_atraso_faixa": "clinica_id,mes_ref,faixa",
-    "inadimplencia": "clinica_id,mes_ref",
-    "tempo_medio_pagamento": "clinica_id,mes_ref",
-    "valor_medio_boleto": "clinica_id,mes_ref",
-    "parcelamentos_detalhe": "clinica_id,mes_ref,qtde_parcelas",
-}
+    return dedupe(registros, conflict_cols)
 
 
 # ==========================
-# REGISTRAR IMPORTAÇÃO
+# IMPORTAÇÃO INCREMENTAL
 # ==========================
 
-def registrar_importacao(clinica_id, arquivo_nome, parsed, contagem):
-    url = f"{SUPABASE_URL}/rest/v1/importacoes"
+# Diff contra o banco antes do upsert: desligado por padrão (opt-in). Custa
+# um GET por tabela (~7 por arquivo) antes de qualquer escrita e só grava os
+# meses que mudaram; o upload pode ligar por requisição (?incremental=true).
+IMPORT_INCREMENTAL = os.getenv("IMPORT_INCREMENTAL", "0") == "1"
 
-    payload = {
-        "clinica_id": clinica_id,
-        "arquivo_nome": arquivo_nome,
-        "total_linhas": sum(contagem.values()),
-        "status": "concluido",
-        "log": contagem
+# Página do GET das linhas existentes (o PostgREST do Supabase corta em 1000)
+IMPORT_PAGINA = 1000
+
+
+def _comparavel(v):
+    """Valor normalizado para comparar o parse com o que volta do PostgREST."""
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return None
+    if isinstance(v, str):
+        v = v.strip()
+        try:
+            return round(float(v), 9)
+        except ValueError:
+            return v
+    if isinstance(v, (int, float)):
+        return round(float(v), 9)
+    return v
+
+
+def buscar_existentes(tabela, clinica_id, colunas, conflict_cols):
+    """Linhas da clínica já gravadas em `tabela`, paginadas."""
+    linhas = []
+    offset = 0
+
+    while True:
+        r = supabase.get(
+            tabela,
+            params={
+                "select": ",".join(colunas),
+                "clinica_id": f"eq.{clinica_id}",
+                "order": ",".join(f"{c}.asc" for c in conflict_cols),
+                "limit": str(IMPORT_PAGINA),
+                "offset": str(offset),
+            },
+        )
+        if r.status_code != 200:
+            raise RuntimeError(f"Erro ao buscar {tabela}: {r.status_code} - {r.text}")
+
+        pagina = r.json()
+        linhas.extend(pagina)
+        if len(pagina) < IMPORT_PAGINA:
+            return linhas
+        offset += IMPORT_PAGINA
+
+
+def diff_registros(tabela, registros, conflict, clinica_id):
+    """
+    Compara as linhas do arquivo com as do banco pelas chaves de conflito.
+    Retorna (enviar, contagem): só as linhas novas ou alteradas, e quantas
+    são inseridas/alteradas/inalteradas.
+    """
+    conflict_cols = [c.strip() for c in conflict.split(",")]
+    colunas = sorted({k for row in registros for k in row})
+
+    existentes = {
+        tuple(_comparavel(row.get(c)) for c in conflict_cols):
+            tuple(_comparavel(row.get(c)) for c in colunas)
+        for row in buscar_existentes(tabela, clinica_id, colunas, conflict_cols)
     }
 
-    requests.post(url, headers=HEADERS, json=payload)
+    enviar = []
+    contagem = {"inseridos": 0, "alterados": 0, "inalterados": 0}
 
+    for row in registros:
+        chave = tuple(_comparavel(row.get(c)) for c in conflict_cols)
+        atual = existentes.get(chave)
 
-# ==========================
-# PROCESSAMENTO FINAL
-# ==========================
+        if atual is None:
+            contagem["inseridos"] += 1
+            enviar.append(row)
+        elif atual != tuple(_comparavel(row.get(c)) for c in colunas):
+            contagem["alterados"] += 1
+            enviar.append(row)
+        else:
+            contagem["inalterados"] += 1
 
-def processar_excel(contents: bytes, arquivo_nome="arquivo.xlsx"):
-    parsed = parse_excel_from_bytes(contents)
+    return enviar, contagem
 
-    clinica = parsed["estabelecimento"]
 
-    clinica_id = get_or_create_clinica(
-        clinica["cnpj"],
-        clinica["external_id"]
-    )
+def _enviar_tabela(tabela, registros, conflict, clinica_id=None, incremental=False):
+    t0 = time.perf_counter()
+    diff = None
+
+    if incremental:
+        try:
+            registros, diff = diff_registros(tabela, registros, conflict, clinica_id)
+        except Exception:
+            diff = None  # sem o estado atual, envia tudo como antes
+
+    try:
+        rejeitadas, divisoes = upsert_em_lotes(tabela, registros, conflict) if registros else ([], 0)
+    except Exception as e:
+        return {"registros": len(registros), "status": "erro", "erro": str(e)}
+    resultado = {
+        "registros": len(registros) - len(rejeitadas),
+        "status": "parcial" if rejeitadas else "ok",
+        "rejeitadas": len(rejeitadas),
+        "divisoes": divisoes,
+        "tempo": round(time.perf_counter() - t0, 3),
+        "_rejeitadas": rejeitadas,
+    }
+    if diff is not None:
+        resultado["diff"] = diff
+    return resultado
+
+
+def enviar_tabelas(parsed, clinica_id, concorrencia=None, incremental=None):
+    """
+    Faz o upsert de todas as tabelas da clínica, até `concorrencia` ao mesmo
+    tempo. Retorna (contagem, resumo, rejeitadas) e levanta ImportacaoError
+    se alguma tabela falhar por completo; linhas recusadas isoladamente só
+    entram em `rejeitadas`.
+
+    Com `incremental`, cada tabela é comparada com o que já está no banco
+    e só as linhas novas ou alteradas são enviadas.
+    """
+    concorrencia = max(1, concorrencia or IMPORT_CONCORRENCIA)
+    if incremental is None:
+        incremental = IMPORT_INCREMENTAL
 
     contagem = {}
+    envios = {}
 
     for tabela, conflict in TABELAS_CONFLITO.items():
-
-        registros = parsed[tabela]
+        registros = registros_da_tabela(parsed, tabela)
         contagem[tabela] = len(registros)
 
-        if not registros:
-            continue
+        if registros:
+            envios[tabela] = (preparar_registros(registros, clinica_id, conflict), conflict)
+
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        futuros = {
+            tabela: pool.submit(_enviar_tabela, tabela, registros, conflict, clinica_id, incremental)
+            for tabela, (registros, conflict) in envios.items()
+        }
+        resumo = {tabela: f.result() for tabela, f in futuros.items()}
+
+    rejeitadas = [
+        {"tabela": tabela, **r}
+        for tabela, res in resumo.items()
+        for r in res.pop("_rejeitadas", [])
+    ]
+
+    falhas = [t for t, r in resumo.items() if r["status"] == "erro"]
+    if falhas:
+        raise ImportacaoError(
+            f"Falha ao enviar {len(falhas)} de {len(resumo)} tabelas: "
+            + "; ".join(f"{t}: {resumo[t]['erro']}" for t in falhas),
+            resumo,
+        )
+
+    return contagem, resumo, rejeitadas
+
 
-        conflict_cols = [c.strip() for c in conflict.split(",")]
+# ==========================
+# PROCESSAMENTO FINAL
+# ==========================
+
+def sha256_de(contents):
+    """SHA-256 dos bytes ou do arquivo no caminho, lido em blocos de 1 MB."""
+    if isinstance(contents, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(contents).hexdigest()
+
+    h = hashlib.sha256()
+    with open(contents, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloco)
+    return h.hexdigest()
 
-        for item in registros:
-            item["clinica_id"] = clinica_id
-            normalize_for_conflict(item, conflict_cols)
 
-        registros = dedupe(registros, conflict_cols)
+def ler_planilha(contents: bytes | str, sha256=None):
+    """parse_excel_from_bytes passando pelo cache em disco (chave = SHA-256)."""
+    sha256 = sha256 or sha256_de(contents)
+    cache = get_cache()
+
+    parsed = cache.obter(sha256)
+    if parsed is None:
+        parsed = parse_excel_from_bytes(contents)
+        try:
+            cache.salvar(sha256, parsed)
+        except OSError:
+            pass  # cache é só otimização; disco cheio não derruba a importação
+
+    return parsed
+
+
+def processar_excel(
+    contents: bytes | str,
+    arquivo_nome="arquivo.xlsx",
+    concorrencia=None,
+    forcar=False,
+    incremental=None,
+    sha256=None,
+):
+    """
+    Importa o arquivo (bytes ou caminho no disco; `sha256` evita reler um
+    arquivo cujo hash já foi calculado no recebimento). Se um arquivo idêntico (mesmo SHA-256) já foi
+    importado sem erros, retorna status "duplicado" apontando para a importação
+    anterior sem reenviar nada — a não ser que `forcar` seja True.
+    `incremental` (padrão IMPORT_INCREMENTAL) envia só os meses que mudaram.
+    """
+    inicio = time.perf_counter()
+    tempos = {}
+
+    sha256 = sha256 or sha256_de(contents)
+
+    if not forcar:
+        anterior = buscar_importacao_por_hash(sha256)
+        if anterior:
+            tempos["total"] = time.perf_counter() - inicio
+            return {
+                "clinica_id": anterior["clinica_id"],
+                "arquivo": arquivo_nome,
+                "sha256": sha256,
+                "duplicado_de": anterior,
+                "tempos": {k: round(v, 3) for k, v in tempos.items()},
+                "status": "duplicado"
+            }
+
+    t0 = time.perf_counter()
+    parsed = ler_planilha(contents, sha256)
+    tempos["parse"] = time.perf_counter() - t0
+
+    clinica = parsed["estabelecimento"]
+
+    t0 = time.perf_counter()
+    clinica_id = get_or_create_clinica(
+        clinica["cnpj"],
+        clinica["external_id"]
+    )
+    tempos["clinica"] = time.perf_counter() - t0
+
+    # Com o id da clínica resolvido as tabelas são independentes entre si
+    t0 = time.perf_counter()
+    contagem, resumo, rejeitadas = enviar_tabelas(parsed, clinica_id, concorrencia, incremental)
+    tempos["upsert"] = time.perf_counter() - t0
 
-        supabase_upsert(tabela, registros, conflict)
+    diff = {t: r["diff"] for t, r in resumo.items() if "diff" in r}
 
-    # SALVAR NO HISTÓRICO
-    registrar_importacao(
+    # SALVAR NO HISTÓRICO (só depois de todas as tabelas)
+    t0 = time.perf_counter()
+    importacao_id = registrar_importacao(
         clinica_id=clinica_id,
         arquivo_nome=arquivo_nome,
         parsed=parsed,
-        contagem=contagem
+        contagem=contagem,
+        rejeitadas=rejeitadas,
+        sha256=sha256,
+        diff=diff,
     )
+    tempos["registro"] = time.perf_counter() - t0
+    tempos["total"] = time.perf_counter() - inicio
 
     return {
         "clinica": clinica,
         "clinica_id": clinica_id,
+        "importacao_id": importacao_id,
         "registros": contagem,
+        "tabelas": resumo,
         "arquivo": arquivo_nome,
-        "status": "ok"
+        "sha256": sha256,
+        "rejeitadas": rejeitadas[:IMPORT_LOG_REJEITADAS],
+        "tempos": {k: round(v, 3) for k, v in tempos.items()},
+        "status": "parcial" if rejeitadas else "ok"
     }
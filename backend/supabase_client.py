@@ -0,0 +1,251 @@
+import asyncio
+import os
+import time
+
+import httpx
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+# ==========================
+# CONFIG
+# ==========================
+
+load_dotenv()
+
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "16"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "30"))
+SUPABASE_MAX_RETRIES = int(os.getenv("SUPABASE_MAX_RETRIES", "3"))
+SUPABASE_BACKOFF = float(os.getenv("SUPABASE_BACKOFF", "0.5"))
+
+# 429 = rate limit do gateway, 5xx = PostgREST/Supabase indisponível
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+# ==========================
+# CLIENTE
+# ==========================
+
+class SupabaseClient:
+    """
+    Cliente PostgREST com uma única requests.Session (conexões keep-alive
+    reaproveitadas), timeout padrão e retry com backoff exponencial.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        pool_size: int = SUPABASE_POOL_SIZE,
+        timeout: float = SUPABASE_TIMEOUT,
+        max_retries: int = SUPABASE_MAX_RETRIES,
+        backoff: float = SUPABASE_BACKOFF,
+    ):
+        self.base_url = f"{url.rstrip('/')}/rest/v1"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        })
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _espera(self, tentativa, r=None):
+        retry_after = r.headers.get("Retry-After") if r is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * (2 ** tentativa)
+
+    def request(self, method, table, *, params=None, json=None, headers=None, idempotente=True):
+        """
+        Executa a requisição em /rest/v1/{table}.
+
+        Requisições idempotentes (GET e upserts) são repetidas em erro de
+        conexão, 429 e 5xx. As demais só em 429, quando o gateway recusou
+        a chamada antes de ela chegar ao banco.
+        """
+        url = f"{self.base_url}/{table}"
+
+        for tentativa in range(self.max_retries + 1):
+            ultima = tentativa == self.max_retries
+
+            try:
+                r = self.session.request(
+                    method,
+                    url,
+                    params=params,
+                    json=json,
+                    headers=headers,
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if ultima or not idempotente:
+                    raise
+                time.sleep(self._espera(tentativa))
+                continue
+
+            pode_repetir = r.status_code == 429 or (idempotente and r.status_code in RETRY_STATUS)
+            if pode_repetir and not ultima:
+                time.sleep(self._espera(tentativa, r))
+                continue
+
+            return r
+
+    def get(self, table, params=None):
+        return self.request("GET", table, params=params)
+
+    def post(self, table, data, on_conflict=None, prefer=None, idempotente=True):
+        params = {"on_conflict": on_conflict} if on_conflict else None
+        headers = {"Prefer": prefer} if prefer else None
+        return self.request(
+            "POST",
+            table,
+            params=params,
+            json=data,
+            headers=headers,
+            idempotente=idempotente,
+        )
+
+
+class AsyncSupabaseClient:
+    """
+    Versão asyncio do SupabaseClient (httpx.AsyncClient). Consultas
+    independentes podem ser disparadas juntas com asyncio.gather, e a
+    latência passa a ser a da mais lenta, não a soma de todas.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        pool_size: int = SUPABASE_POOL_SIZE,
+        timeout: float = SUPABASE_TIMEOUT,
+        max_retries: int = SUPABASE_MAX_RETRIES,
+        backoff: float = SUPABASE_BACKOFF,
+    ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.client = httpx.AsyncClient(
+            base_url=f"{url.rstrip('/')}/rest/v1",
+            headers={
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Content-Type": "application/json",
+            },
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+            ),
+        )
+
+    def _espera(self, tentativa, r=None):
+        retry_after = r.headers.get("Retry-After") if r is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * (2 ** tentativa)
+
+    async def request(self, method, table, *, params=None, json=None, headers=None, idempotente=True):
+        """Mesma política de retry do SupabaseClient.request."""
+        for tentativa in range(self.max_retries + 1):
+            ultima = tentativa == self.max_retries
+
+            try:
+                r = await self.client.request(
+                    method,
+                    f"/{table}",
+                    params=params,
+                    json=json,
+                    headers=headers,
+                )
+            except httpx.TransportError:
+                if ultima or not idempotente:
+                    raise
+                await asyncio.sleep(self._espera(tentativa))
+                continue
+
+            pode_repetir = r.status_code == 429 or (idempotente and r.status_code in RETRY_STATUS)
+            if pode_repetir and not ultima:
+                await asyncio.sleep(self._espera(tentativa, r))
+                continue
+
+            return r
+
+    async def get(self, table, params=None):
+        return await self.request("GET", table, params=params)
+
+    async def post(self, table, data, on_conflict=None, prefer=None, idempotente=True):
+        params = {"on_conflict": on_conflict} if on_conflict else None
+        headers = {"Prefer": prefer} if prefer else None
+        return await self.request(
+            "POST",
+            table,
+            params=params,
+            json=data,
+            headers=headers,
+            idempotente=idempotente,
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# ==========================
+# CLIENTE PADRÃO (.env)
+# ==========================
+
+_client = None
+_async_client = None
+
+
+def _config_env():
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+    if not url:
+        raise RuntimeError("⚠️ Defina SUPABASE_URL no .env")
+
+    # remover "db." se vier na URL
+    if "db." in url:
+        url = url.replace("db.", "")
+
+    if not key:
+        raise RuntimeError("⚠️ Defina SUPABASE_SERVICE_ROLE_KEY no .env")
+
+    return url, key
+
+
+def get_client() -> SupabaseClient:
+    """Cliente compartilhado por todo o processo, configurado pelo .env."""
+    global _client
+
+    if _client is None:
+        _client = SupabaseClient(*_config_env())
+
+    return _client
+
+
+def get_async_client() -> AsyncSupabaseClient:
+    """Cliente assíncrono compartilhado (um por processo/event loop)."""
+    global _async_client
+
+    if _async_client is None:
+        _async_client = AsyncSupabaseClient(*_config_env())
+
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -0,0 +1,112 @@
+"""
+Golden do parse sobre as planilhas de Clinicas/.
+
+Os três front-ends (processor, importar e converter) têm que devolver
+exatamente o mesmo resultado do motor em planilha.py, e esse resultado tem
+que bater com o golden_parse.json gravado (linhas + SHA-256 por tabela).
+
+    python verificar_parse.py                # compara
+    python verificar_parse.py --atualizar    # regrava o golden após mudança intencional
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(AQUI)
+sys.path.insert(0, RAIZ)
+
+# processor/importar criam o cliente Supabase no import; nenhuma chamada é feita aqui
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "verificar_parse")
+
+import converter
+import importar
+import processor
+
+GOLDEN = os.path.join(AQUI, "golden_parse.json")
+PASTA = os.path.join(RAIZ, "Clinicas")
+
+
+def _de_converter(path):
+    volta = {v: k for k, v in converter.CHAVES_JSON.items()}
+    return {volta.get(k, k): v for k, v in converter.parse_excel(path).items()}
+
+
+FRONT_ENDS = {
+    "processor": lambda path: processor.parse_excel_from_bytes(open(path, "rb").read()),
+    "importar": lambda path: importar.parse_excel_from_bytes(open(path, "rb").read()),
+    "converter": _de_converter,
+}
+
+
+def resumo(parsed):
+    """Linhas e SHA-256 (JSON canônico, int ≠ float) de cada tabela."""
+    out = {}
+    for tabela, valor in sorted(parsed.items()):
+        texto = json.dumps(valor, sort_keys=True, ensure_ascii=False, default=str)
+        out[tabela] = {
+            "linhas": len(valor) if isinstance(valor, list) else 1,
+            "sha256": hashlib.sha256(texto.encode()).hexdigest(),
+        }
+    return out
+
+
+def gerar(pasta):
+    resultado, divergencias = {}, []
+
+    for caminho in sorted(glob.glob(os.path.join(pasta, "*.xlsx"))):
+        nome = os.path.basename(caminho)
+        saidas = {fe: resumo(fn(caminho)) for fe, fn in FRONT_ENDS.items()}
+
+        base = saidas["processor"]
+        for fe, saida in saidas.items():
+            if saida != base:
+                divergencias.append(f"{nome}: {fe} diverge do processor")
+
+        resultado[nome] = base
+
+    return resultado, divergencias
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Confere o parse das planilhas contra o golden.")
+    parser.add_argument("--pasta", default=PASTA)
+    parser.add_argument("--atualizar", action="store_true", help="regrava golden_parse.json")
+    args = parser.parse_args()
+
+    atual, problemas = gerar(args.pasta)
+
+    if args.atualizar:
+        if problemas:
+            print("\n".join(problemas))
+            sys.exit("❌ Front-ends divergentes; golden não atualizado.")
+        with open(GOLDEN, "w") as f:
+            json.dump(atual, f, indent=1, sort_keys=True)
+            f.write("\n")
+        print(f"✅ Golden atualizado: {len(atual)} arquivos")
+        sys.exit(0)
+
+    with open(GOLDEN) as f:
+        golden = json.load(f)
+
+    for nome in sorted(set(golden) | set(atual)):
+        if nome not in atual:
+            problemas.append(f"{nome}: está no golden mas não na pasta")
+        elif nome not in golden:
+            problemas.append(f"{nome}: arquivo novo, fora do golden")
+        else:
+            for tabela in sorted(set(golden[nome]) | set(atual[nome])):
+                g, a = golden[nome].get(tabela), atual[nome].get(tabela)
+                if g != a:
+                    problemas.append(f"{nome} / {tabela}: golden={g} atual={a}")
+
+    if problemas:
+        print("\n".join(problemas))
+        sys.exit(f"❌ {len(problemas)} divergências")
+
+    print(f"✅ {len(atual)} arquivos iguais ao golden nos {len(FRONT_ENDS)} front-ends")
@@ -21,6 +21,18 @@ export default function Upload() {
     if (dropped.length > 0) setFiles(dropped);
   };
 
+  // O backend responde na hora com um job; acompanhamos até terminar.
+  const aguardarJob = async (jobId) => {
+    while (true) {
+      const res = await fetch(`${API_BASE_URL}/upload/jobs/${jobId}`);
+      const job = await res.json();
+      if (!res.ok || job.estado === "concluido" || job.estado === "erro") {
+        return job;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  };
+
   const upload = async () => {
     if (files.length === 0 || loading) return;
 
@@ -41,7 +53,14 @@ export default function Upload() {
         });
 
         const json = await res.json();
-        newResults.push({ file: file.name, data: json, error: !res.ok });
+
+        if (!res.ok) {
+          newResults.push({ file: file.name, data: json, error: true });
+          continue;
+        }
+
+        const job = await aguardarJob(json.id);
+        newResults.push({ file: file.name, data: job, error: job.estado === "erro" });
 
       } catch (err) {
         newResults.push({
@@ -314,7 +333,11 @@ export default function Upload() {
                           }
                         `}
                       >
-                        {res.error ? "Erro" : "OK"}
+                        {res.error
+                          ? "Erro"
+                          : res.data?.resultado?.status === "duplicado"
+                          ? "Já importado"
+                          : "OK"}
                       </span>
                     </div>
 